@@ -0,0 +1,37 @@
+"""
+Creates staff accounts from the command line, e.g. the first admin:
+
+    python -m app.accounts admin@example.org "Site Admin" --role admin --facility north
+
+Public signup only creates doctors and nurses in the default facility. Admins
+and staff of other facilities are created here or by an admin through
+`POST /facilities/{facility_id}/users`.
+"""
+import argparse
+import getpass
+import sys
+
+from . import crud, models, schemas
+from .database import DEFAULT_FACILITY, facility_engines, facility_sessions
+from .dependencies import ROLES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a staff account.")
+    parser.add_argument("email")
+    parser.add_argument("full_name")
+    parser.add_argument("--role", choices=ROLES, default="admin")
+    parser.add_argument("--facility", choices=list(facility_sessions), default=DEFAULT_FACILITY)
+    args = parser.parse_args()
+
+    for shard_engine in facility_engines.values():
+        models.Base.metadata.create_all(bind=shard_engine)
+    if crud.find_user_by_email(email=args.email):
+        sys.exit(f"{args.email} is already registered")
+    password = getpass.getpass("Password: ")
+
+    with facility_sessions[args.facility]() as db:
+        user = crud.create_user(db, schemas.UserCreate(
+            email=args.email, full_name=args.full_name, role=args.role, password=password
+        ))
+    print(f"Created {user.role} {user.email} (user {user.user_id}) in facility {user.facility_id}")
@@ -0,0 +1,90 @@
+"""
+Archival job for appointments and prescriptions.
+
+Moves rows past their retention window from the hot tables into
+`appointments_archive` / `prescriptions_archive`, in batches with one commit
+each, so the hot tables stay small no matter how much history accumulates.
+Schedule it nightly (e.g. from cron):
+
+    python -m app.archive
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models, sync
+from .config import settings
+
+logger = logging.getLogger("hms.archive")
+
+
+def _move_rows(db: Session, entity: str, model, archive_model, primary_key, timestamp_column, before: datetime, batch_size: int) -> int:
+    columns = [column.name for column in archive_model.__table__.columns]
+    source_columns = [model.__table__.c[name] for name in columns]
+    moved = 0
+    while True:
+        ids = [
+            row_id for (row_id,) in
+            db.query(primary_key)
+            .filter(timestamp_column < before)
+            .order_by(primary_key)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        db.execute(
+            insert(archive_model.__table__).from_select(
+                columns, select(*source_columns).where(primary_key.in_(ids))
+            )
+        )
+        db.execute(delete(model.__table__).where(primary_key.in_(ids)))
+        # Synced clients only hold current records, so archived rows are tombstoned
+        sync.record_changes(db, entity, ids, operation="delete")
+        db.commit()
+        moved += len(ids)
+    return moved
+
+
+def archive_appointments(db: Session, before: datetime, batch_size: int = settings.ARCHIVE_BATCH_SIZE) -> int:
+    """Moves appointments scheduled before `before` into the archive. Returns the number moved."""
+    return _move_rows(
+        db, "appointments", models.Appointment, models.AppointmentArchive,
+        models.Appointment.appointment_id, models.Appointment.appointment_date,
+        before, batch_size
+    )
+
+
+def archive_prescriptions(db: Session, before: datetime, batch_size: int = settings.ARCHIVE_BATCH_SIZE) -> int:
+    """Moves prescriptions written before `before` into the archive. Returns the number moved."""
+    return _move_rows(
+        db, "prescriptions", models.Prescription, models.PrescriptionArchive,
+        models.Prescription.prescription_id, models.Prescription.created_at,
+        before, batch_size
+    )
+
+
+def run_archival(db: Session):
+    now = datetime.now(timezone.utc)
+    appointments = archive_appointments(db, now - timedelta(days=settings.APPOINTMENT_ARCHIVE_AFTER_DAYS))
+    prescriptions = archive_prescriptions(db, now - timedelta(days=settings.PRESCRIPTION_ARCHIVE_AFTER_DAYS))
+    logger.info("Archived %s appointments and %s prescriptions", appointments, prescriptions)
+    return appointments, prescriptions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import facility_engines, facility_sessions
+
+    parser = argparse.ArgumentParser(description="Move old appointments and prescriptions to the archive tables.")
+    parser.add_argument("--facility", choices=list(facility_sessions), action="append", help="Facility to process, may be repeated (default: all)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    for facility in args.facility or facility_sessions:
+        logger.info("Archiving facility %s", facility)
+        models.Base.metadata.create_all(bind=facility_engines[facility])
+        with facility_sessions[facility]() as db:
+            run_archival(db)
@@ -0,0 +1,311 @@
+"""
+Audit log of patient data access.
+
+Routers call `audit_log.record(...)` for every read or change of a patient's
+record. Events go into an in-memory buffer and a background thread writes
+them with one multi-row INSERT per batch, so auditing adds no database round
+trip to the request itself.
+
+Events are written to the database of the facility the request was for,
+next to the patient records they refer to.
+
+Loss is bounded: the buffer is flushed every AUDIT_FLUSH_INTERVAL_SECONDS and
+on application shutdown. Recording never waits on the database. The buffer
+holds at most AUDIT_MAX_BUFFER events (e.g. while the database is down);
+further events are appended to the local file AUDIT_SPILL_PATH, which the
+flusher loads into the database once writes succeed again. Events are only
+dropped, and counted in `dropped`, if even that file cannot be written.
+
+Several API processes may share the spill file. Changes to it are serialised
+with a lock file next to it, and a process loading spilled events first
+renames them to a `.loading` file of its own and keeps that locked, so no two
+processes insert the same events. A `.loading` file left by a process that
+died is picked up by the next flush of any process.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import insert
+
+from . import models
+from .config import settings
+from .database import DEFAULT_FACILITY, facility_sessions, home_facility, request_facility
+
+try:
+    import fcntl
+except ImportError:  # Windows: spill files are then only safe within one process
+    fcntl = None
+
+logger = logging.getLogger("hms.audit")
+
+
+class AuditLogger:
+
+    def __init__(
+        self,
+        session_factories=facility_sessions,
+        flush_interval: float = settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+        batch_size: int = settings.AUDIT_BATCH_SIZE,
+        max_buffer: int = settings.AUDIT_MAX_BUFFER,
+        spill_path: str = settings.AUDIT_SPILL_PATH,
+    ):
+        self.session_factories = session_factories
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        # Counters for monitoring: events written to the spill file, and events lost
+        self.spilled = 0
+        self.dropped = 0
+        self._buffer = deque()
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and writes out everything still buffered."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        # Whatever the database did not take must survive the restart
+        with self._flush_lock:
+            self._spill([self._buffer.popleft() for _ in range(len(self._buffer))])
+
+    def record(
+        self,
+        action: str,
+        resource: str,
+        user_id: Optional[int],
+        patient_id: Optional[int],
+        resource_id: Optional[int] = None,
+        request: Optional[Request] = None,
+        facility: Optional[str] = None,
+    ):
+        self.record_many(action, resource, user_id, [(patient_id, resource_id)], request, facility)
+
+    def record_many(
+        self,
+        action: str,
+        resource: str,
+        user_id: Optional[int],
+        targets: Iterable,
+        request: Optional[Request] = None,
+        facility: Optional[str] = None,
+    ):
+        """
+        Records one event per (patient_id, resource_id) pair, e.g. for list reads.
+
+        `facility` defaults to the facility the request was for. The user's
+        own facility is stored with `user_id`, as user ids are per facility.
+        """
+        occurred_at = datetime.now(timezone.utc)
+        client_address = request.client.host if request is not None and request.client else None
+        user_facility = home_facility(request) if request is not None and user_id is not None else None
+        if facility is None:
+            facility = request_facility(request) if request is not None else DEFAULT_FACILITY
+        events = [
+            (facility, {
+                "occurred_at": occurred_at,
+                "user_id": user_id,
+                "user_facility_id": user_facility,
+                "patient_id": patient_id,
+                "action": action,
+                "resource": resource,
+                "resource_id": resource_id,
+                "client_address": client_address,
+            })
+            for patient_id, resource_id in targets
+        ]
+
+        if len(self._buffer) + len(events) > self.max_buffer:
+            self._spill(events)
+        else:
+            # deque.extend is atomic, so recording never waits on the flusher
+            self._buffer.extend(events)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Writes all buffered and spilled events. Returns the number written."""
+        written = 0
+        with self._flush_lock:
+            while self._buffer:
+                batch = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+                by_facility = {}
+                for facility, event in batch:
+                    by_facility.setdefault(facility, []).append(event)
+                failed = []
+                for facility, events in by_facility.items():
+                    if self._write(facility, events):
+                        written += len(events)
+                    else:
+                        failed.extend((facility, event) for event in events)
+                if failed:
+                    # Put the failed events back in order and retry on the next flush,
+                    # keeping no more than max_buffer of them in memory
+                    self._buffer.extendleft(reversed(failed))
+                    overflow = len(self._buffer) - self.max_buffer
+                    if overflow > 0:
+                        self._spill([self._buffer.pop() for _ in range(overflow)][::-1])
+                    return written
+            # The database takes writes again, catch up on what was spilled
+            written += self._load_spill()
+        return written
+
+    def _write(self, facility: str, events: List[dict]) -> bool:
+        try:
+            with self.session_factories[facility]() as db:
+                db.execute(insert(models.AuditEvent), events)
+                db.commit()
+        except Exception:
+            logger.exception("Failed to write %s audit events for %s, will retry", len(events), facility)
+            return False
+        return True
+
+    def _spill(self, events: List[Tuple[str, dict]]):
+        """Appends events to the spill file, one JSON object per line."""
+        if not events:
+            return
+        if not self._append_to_spill_file(events):
+            self.dropped += len(events)
+            logger.error("Dropped %s audit events", len(events))
+            return
+        self.spilled += len(events)
+        logger.warning("Audit buffer full, spilled %s events to %s", len(events), self.spill_path)
+
+    def _append_to_spill_file(self, events: List[Tuple[str, dict]]) -> bool:
+        lines = "".join(
+            json.dumps({**event, "facility": facility, "occurred_at": event["occurred_at"].isoformat()}) + "\n"
+            for facility, event in events
+        )
+        try:
+            with self._spill_file_lock(), open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError:
+            logger.exception("Failed to write %s audit events to %s", len(events), self.spill_path)
+            return False
+        return True
+
+    @contextmanager
+    def _spill_file_lock(self):
+        """Serialises changes to the spill files between threads and processes."""
+        with self._spill_lock, open(self.spill_path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield  # Closing the lock file releases the lock
+
+    def _lock_for_loading(self, path: str):
+        """Opens and locks a spill file for loading, or returns None if another loader holds it."""
+        try:
+            f = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return None
+        return f
+
+    def _claim_spill_files(self) -> list:
+        """
+        Locks the spill files this process will load: leftover `.loading`
+        files and the current spill file. Returns (open file, path) pairs.
+        """
+        claimed = []
+        try:
+            with self._spill_file_lock():
+                # Left by a loader that failed or died, its lock went with it
+                for path in glob.glob(glob.escape(self.spill_path) + "*.loading"):
+                    f = self._lock_for_loading(path)
+                    if f is not None:
+                        claimed.append((f, path))
+                # Move the spill file aside, still locked, so new spills start a fresh one
+                f = self._lock_for_loading(self.spill_path)
+                if f is not None:
+                    loading_path = f"{self.spill_path}.{uuid.uuid4().hex}.loading"
+                    os.replace(self.spill_path, loading_path)
+                    claimed.append((f, loading_path))
+        except OSError:
+            logger.exception("Failed to open the audit spill files at %s", self.spill_path)
+        return claimed
+
+    def _load_spill(self) -> int:
+        """Writes spilled events to the database. Returns the number written."""
+        written = 0
+        for f, loading_path in self._claim_spill_files():
+            with f:
+                written += self._load_spill_file(f, loading_path)
+        return written
+
+    def _load_spill_file(self, f, loading_path: str) -> int:
+        by_facility = {}
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash mid-write
+                logger.error("Skipping unreadable spilled audit event: %r", line)
+                continue
+            event["occurred_at"] = datetime.fromisoformat(event["occurred_at"])
+            by_facility.setdefault(event.pop("facility"), []).append(event)
+
+        written = 0
+        remaining = []
+        for facility, events in by_facility.items():
+            if facility not in self.session_factories:
+                logger.error("Keeping %s spilled audit events of unknown facility %s", len(events), facility)
+                remaining.extend((facility, event) for event in events)
+                continue
+            for start in range(0, len(events), self.batch_size):
+                batch = events[start:start + self.batch_size]
+                if not self._write(facility, batch):
+                    # Keep this and the facility's later batches for the next flush
+                    remaining.extend((facility, event) for event in events[start:])
+                    break
+                written += len(batch)
+
+        # Events that still could not be written go back to the spill file;
+        # otherwise the file stays for a later flush
+        if not remaining or self._append_to_spill_file(remaining):
+            with self._spill_file_lock():
+                os.remove(loading_path)
+        return written
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Keep the thread alive, the events stay buffered for the next flush
+                logger.exception("Audit flush failed")
+
+
+audit_log = AuditLogger()
+
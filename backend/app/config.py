@@ -10,4 +10,63 @@ class Settings:
     
     DATABASE_URL: str = os.getenv("DATABASE_URL")
 
+    # Document post-processing worker
+    JOB_POLL_INTERVAL_SECONDS: float = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 2))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    JOB_BACKOFF_BASE_SECONDS: int = int(os.getenv("JOB_BACKOFF_BASE_SECONDS", 30))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", 600))
+    JOB_LEASE_SWEEP_INTERVAL_SECONDS: int = int(os.getenv("JOB_LEASE_SWEEP_INTERVAL_SECONDS", 60))
+    THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", 256))
+    VIRUS_SCAN_TIMEOUT_SECONDS: int = int(os.getenv("VIRUS_SCAN_TIMEOUT_SECONDS", 120))
+    # Without ClamAV the scan job fails and documents are never parsed, unless
+    # this is set (e.g. for local development)
+    ALLOW_UNSCANNED_DOCUMENTS: bool = os.getenv("ALLOW_UNSCANNED_DOCUMENTS", "false").lower() == "true"
+    # Longer extracted text is truncated, keeping search index entries bounded
+    EXTRACTED_TEXT_MAX_CHARS: int = int(os.getenv("EXTRACTED_TEXT_MAX_CHARS", 500000))
+
+    # Rows older than this are moved to the archive tables by `python -m app.archive`
+    APPOINTMENT_ARCHIVE_AFTER_DAYS: int = int(os.getenv("APPOINTMENT_ARCHIVE_AFTER_DAYS", 90))
+    PRESCRIPTION_ARCHIVE_AFTER_DAYS: int = int(os.getenv("PRESCRIPTION_ARCHIVE_AFTER_DAYS", 365))
+    ARCHIVE_BATCH_SIZE: int = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+
+    # Rate limiting for the public appointment booking endpoint
+    BOOKING_RATE_PER_MINUTE: float = float(os.getenv("BOOKING_RATE_PER_MINUTE", 10))
+    BOOKING_BURST: int = int(os.getenv("BOOKING_BURST", 5))
+    RATE_LIMIT_REDIS_URL: str = os.getenv("RATE_LIMIT_REDIS_URL", "")  # Shared buckets across API processes
+    TRUST_FORWARDED_FOR: bool = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+    # Admission control: requests in flight per process before shedding load.
+    # Lower priorities are shed first, at a fraction of MAX_CONCURRENT_REQUESTS
+    # or of the database pool (DB_POOL_SIZE + DB_MAX_OVERFLOW), whichever is smaller.
+    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", 64))
+    PUBLIC_CONCURRENCY_SHARE: float = float(os.getenv("PUBLIC_CONCURRENCY_SHARE", 0.25))
+    DEFAULT_CONCURRENCY_SHARE: float = float(os.getenv("DEFAULT_CONCURRENCY_SHARE", 0.75))
+    SHED_RETRY_AFTER_SECONDS: int = int(os.getenv("SHED_RETRY_AFTER_SECONDS", 2))
+
+    # PHI access audit log. Events are buffered in memory and inserted in
+    # batches; at most AUDIT_FLUSH_INTERVAL_SECONDS of events can be lost if
+    # the process is killed without a clean shutdown.
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", 1))
+    AUDIT_BATCH_SIZE: int = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+    AUDIT_MAX_BUFFER: int = int(os.getenv("AUDIT_MAX_BUFFER", 10000))
+    # Events beyond AUDIT_MAX_BUFFER (e.g. while the database is down) are
+    # appended to this file and loaded into the database once it is back
+    AUDIT_SPILL_PATH: str = os.getenv(
+        "AUDIT_SPILL_PATH",
+        os.path.abspath(os.path.join(os.path.dirname(__file__), '../audit_spill.jsonl'))
+    )
+
+    # Patient duplicate detection: pairs scoring at least this (0-1) are reported
+    DEDUP_THRESHOLD: float = float(os.getenv("DEDUP_THRESHOLD", 0.8))
+
+    # Formulary used for medication interaction checks
+    FORMULARY_PATH: str = os.getenv(
+        "FORMULARY_PATH",
+        os.path.abspath(os.path.join(os.path.dirname(__file__), '../formulary.json'))
+    )
+    # Prescriptions written within this many days count as the patient's
+    # current medications in interaction checks; older ones (finished courses,
+    # earlier refills) are not checked against
+    ACTIVE_PRESCRIPTION_DAYS: int = int(os.getenv("ACTIVE_PRESCRIPTION_DAYS", 30))
+
 settings = Settings()
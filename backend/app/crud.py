@@ -1,11 +1,44 @@
+import heapq
+import itertools
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import case
 from sqlalchemy.orm import Session
-from . import models, schemas, security
-from typing import Optional
+from sqlalchemy.sql import func
+from . import dedup, models, schemas, search, security, sync
+from .config import settings
+from .database import fan_out
+from typing import Optional, Dict, List
+
+# Post-processing steps run by the worker for every uploaded document. Only
+# the virus scan is enqueued on upload; the parsers are enqueued once it has
+# finished with one of SAFE_SCAN_RESULTS, so they never see an unscanned file
+# ('unscanned' is only produced when ALLOW_UNSCANNED_DOCUMENTS is set).
+POST_SCAN_JOB_TYPES = ["thumbnail", "extract_text"]
+SAFE_SCAN_RESULTS = ("clean", "unscanned")
+
+def _before_cutoff(day: date, archive_after_days: int) -> bool:
+    return day < datetime.now(timezone.utc).date() - timedelta(days=archive_after_days)
+
+def _paginate_merged(queries, key, skip: int, limit: int):
+    """Applies skip/limit across several queries that are each ordered by `key`."""
+    if len(queries) == 1:
+        return queries[0].offset(skip).limit(limit).all()
+    rows = heapq.merge(*(query.limit(skip + limit).all() for query in queries), key=key)
+    return list(itertools.islice(rows, skip, skip + limit))
+
+def _with_fieldset(query, model, fieldset):
+    # Restrict loaded columns/relations when the caller asked for a sparse fieldset
+    return query.options(*fieldset.options(model)) if fieldset is not None else query
 
 def get_user_by_email(db: Session, email: str):
 
     return db.query(models.User).filter(models.User.email == email).first()
 
+def find_user_by_email(email: str):
+    """Looks the email up on every facility shard; emails are unique across facilities."""
+    users = fan_out(lambda db: get_user_by_email(db, email))
+    return next((user for user in users.values() if user is not None), None)
+
 def create_user(db: Session, user: schemas.UserCreate):
 
     hashed_password = security.get_password_hash(user.password)
@@ -13,7 +46,8 @@ def create_user(db: Session, user: schemas.UserCreate):
         email=user.email,
         full_name=user.full_name,
         password_hash=hashed_password,
-        role=user.role
+        role=user.role,
+        facility_id=db.info["facility"]
     )
     db.add(db_user)
     db.commit()
@@ -26,14 +60,147 @@ def get_patient(db: Session, patient_id: int):
     
     return db.query(models.Patient).filter(models.Patient.patient_id == patient_id).first()
 
-def get_patients(db: Session, skip: int = 0, limit: int = 100):
+def get_patients(db: Session, skip: int = 0, limit: int = 100, fieldset=None):
   
-    return db.query(models.Patient).offset(skip).limit(limit).all()
+    query = _with_fieldset(db.query(models.Patient), models.Patient, fieldset)
+    return query.offset(skip).limit(limit).all()
 
 def create_patient(db: Session, patient: schemas.PatientCreate, user_id: int):
 
-    db_patient = models.Patient(**patient.model_dump(), registered_by=user_id)
+    db_patient = models.Patient(
+        **patient.model_dump(),
+        registered_by=user_id,
+        match_key=dedup.match_key(patient.full_name, patient.date_of_birth),
+        facility_id=db.info["facility"]
+    )
     db.add(db_patient)
+    db.flush()
+    sync.record_change(db, "patients", db_patient.patient_id)
+    db.commit()
+    db.refresh(db_patient)
+    return db_patient
+
+def get_patients_all_facilities(skip: int = 0, limit: int = 100, name: Optional[str] = None):
+    """
+    Patients of every facility, most recently registered first. Each shard
+    returns its first skip+limit rows and the sorted results are merged.
+    """
+    def query(db: Session):
+        patients = db.query(models.Patient)
+        if name:
+            patients = patients.filter(models.Patient.full_name.ilike(f"%{name}%"))
+        return (
+            patients.order_by(models.Patient.created_at.desc(), models.Patient.patient_id.desc())
+            .limit(skip + limit)
+            .all()
+        )
+
+    rows = heapq.merge(
+        *fan_out(query).values(),
+        key=lambda patient: (patient.created_at, patient.patient_id),
+        reverse=True
+    )
+    return list(itertools.islice(rows, skip, skip + limit))
+
+def get_facility_summaries():
+    """Patient and bed counts of every facility."""
+    def summarize(db: Session):
+        patients = db.query(func.count(models.Patient.patient_id)).scalar()
+        beds, occupied_beds = db.query(
+            func.count(models.Bed.bed_id),
+            func.coalesce(func.sum(case((models.Bed.is_occupied, 1), else_=0)), 0)
+        ).one()
+        return {"patients": patients, "beds": beds, "occupied_beds": occupied_beds}
+
+    return [
+        {"facility_id": facility, **summary}
+        for facility, summary in fan_out(summarize).items()
+    ]
+
+def get_duplicate_candidates(db: Session, skip: int = 0, limit: int = 100, status: str = 'open'):
+
+    return (
+        db.query(models.DuplicateCandidate)
+        .filter(models.DuplicateCandidate.status == status)
+        .order_by(models.DuplicateCandidate.score.desc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
+def dismiss_duplicate_candidate(db: Session, candidate_id: int):
+    db_candidate = (
+        db.query(models.DuplicateCandidate)
+        .filter(models.DuplicateCandidate.candidate_id == candidate_id)
+        .first()
+    )
+    if db_candidate:
+        db_candidate.status = 'dismissed'
+        db.commit()
+        db.refresh(db_candidate)
+    return db_candidate
+
+def merge_patients(db: Session, patient_id: int, duplicate_id: int):
+    """
+    Merges `duplicate_id` into `patient_id` in one transaction.
+
+    Prescriptions, documents, appointments (including archived ones) and search
+    entries are re-pointed to the surviving patient, empty fields on it are
+    filled from the duplicate, and the duplicate is deleted. If both patients
+    have a bed, the duplicate's bed is released.
+    """
+    db_patient = get_patient(db, patient_id)
+    db_duplicate = get_patient(db, duplicate_id)
+    if db_patient is None or db_duplicate is None:
+        return None
+
+    moved = {}
+    for entity, model, primary_key in (
+        ("prescriptions", models.Prescription, models.Prescription.prescription_id),
+        ("documents", models.Document, models.Document.document_id),
+        ("appointments", models.Appointment, models.Appointment.appointment_id),
+    ):
+        moved[entity] = [
+            row_id for (row_id,) in db.query(primary_key).filter(model.patient_id == duplicate_id)
+        ]
+    for model in (
+        models.Prescription,
+        models.PrescriptionArchive,
+        models.Document,
+        models.Appointment,
+        models.AppointmentArchive,
+        models.SearchEntry,
+    ):
+        db.query(model).filter(model.patient_id == duplicate_id).update(
+            {model.patient_id: patient_id}, synchronize_session=False
+        )
+
+    duplicate_bed = db_duplicate.bed
+    if duplicate_bed is not None:
+        if db_patient.bed is None:
+            duplicate_bed.patient_id = patient_id
+        else:
+            duplicate_bed.patient_id = None
+            duplicate_bed.is_occupied = False
+        moved["beds"] = [duplicate_bed.bed_id]
+        # Release the unique patient_id before the duplicate row goes away
+        db.flush()
+
+    for field in ("gender", "contact_number", "address", "presenting_complaint", "triage_level"):
+        if getattr(db_patient, field) is None:
+            setattr(db_patient, field, getattr(db_duplicate, field))
+
+    db.query(models.DuplicateCandidate).filter(
+        (models.DuplicateCandidate.patient_id == duplicate_id)
+        | (models.DuplicateCandidate.duplicate_id == duplicate_id)
+    ).delete(synchronize_session=False)
+    db.expire(db_duplicate)
+    db.delete(db_duplicate)
+
+    for entity, ids in moved.items():
+        sync.record_changes(db, entity, ids)
+    sync.record_change(db, "patients", patient_id)
+    sync.record_change(db, "patients", duplicate_id, operation="delete")
     db.commit()
     db.refresh(db_patient)
     return db_patient
@@ -46,14 +213,16 @@ def update_patient_triage_level(db: Session, patient_id: int, triage_level: Opti
     db_patient = get_patient(db, patient_id)
     if db_patient:
         db_patient.triage_level = triage_level
+        sync.record_change(db, "patients", patient_id)
         db.commit()
         db.refresh(db_patient)
     return db_patient
 
-def get_beds(db: Session, skip: int = 0, limit: int = 100):
+def get_beds(db: Session, skip: int = 0, limit: int = 100, fieldset=None):
     
 
-    return db.query(models.Bed).offset(skip).limit(limit).all()
+    query = _with_fieldset(db.query(models.Bed), models.Bed, fieldset)
+    return query.offset(skip).limit(limit).all()
 
 def get_bed(db: Session, bed_id: int):
 
@@ -66,6 +235,7 @@ def update_bed(db: Session, bed_id: int, bed_update: schemas.BedUpdate):
     if db_bed:
         db_bed.is_occupied = bed_update.is_occupied
         db_bed.patient_id = bed_update.patient_id
+        sync.record_change(db, "beds", bed_id)
         db.commit()
         db.refresh(db_bed)
     return db_bed
@@ -81,19 +251,48 @@ def create_appointment(db: Session, appointment: schemas.AppointmentCreate):
         status='pending'
     )
     db.add(db_appointment)
+    db.flush()
+    sync.record_change(db, "appointments", db_appointment.appointment_id)
     db.commit()
     db.refresh(db_appointment)
     return db_appointment
 
-def get_appointments(db: Session, skip: int = 0, limit: int = 100):
-
-    return db.query(models.Appointment).offset(skip).limit(limit).all()
+def get_appointments(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    day: Optional[date] = None,
+    include_archived: bool = False,
+    fieldset=None
+):
+    """
+    Lists appointments, optionally only those on `day`.
+
+    Only the hot table is read unless archived rows are asked for or `day` is
+    older than the archive cutoff, so today's clinic list never touches history.
+    """
+    queries = []
+    for model in (models.Appointment, models.AppointmentArchive):
+        if model is models.AppointmentArchive and not (
+            include_archived or (day is not None and _before_cutoff(day, settings.APPOINTMENT_ARCHIVE_AFTER_DAYS))
+        ):
+            continue
+        query = _with_fieldset(db.query(model), model, fieldset)
+        if day is not None:
+            start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            query = query.filter(
+                model.appointment_date >= start,
+                model.appointment_date < start + timedelta(days=1)
+            )
+        queries.append(query.order_by(model.appointment_id))
+    return _paginate_merged(queries, lambda a: a.appointment_id, skip, limit)
 
 def update_appointment_status(db: Session, appointment_id: int, status: str):
     """Updates the status of an appointment."""
     db_appointment = db.query(models.Appointment).filter(models.Appointment.appointment_id == appointment_id).first()
     if db_appointment:
         db_appointment.status = status
+        sync.record_change(db, "appointments", appointment_id)
         db.commit()
         db.refresh(db_appointment)
     return db_appointment
@@ -105,13 +304,59 @@ def create_prescription(db: Session, prescription: schemas.PrescriptionCreate, d
         doctor_id=doctor_id
     )
     db.add(db_prescription)
+    db.flush()
+    search.index_prescription(db, db_prescription)
+    sync.record_change(db, "prescriptions", db_prescription.prescription_id)
     db.commit()
     db.refresh(db_prescription)
     return db_prescription
 
-def get_prescriptions_for_patient(db: Session, patient_id: int):
- 
-    return db.query(models.Prescription).filter(models.Prescription.patient_id == patient_id).all()
+def create_prescriptions(db: Session, patient_id: int, items: List[schemas.PrescriptionBase], doctor_id: int):
+    """Writes a whole order set in a single transaction."""
+    db_prescriptions = [
+        models.Prescription(**item.model_dump(), patient_id=patient_id, doctor_id=doctor_id)
+        for item in items
+    ]
+    db.add_all(db_prescriptions)
+    db.flush()
+    for db_prescription in db_prescriptions:
+        search.index_prescription(db, db_prescription)
+    prescription_ids = [db_prescription.prescription_id for db_prescription in db_prescriptions]
+    sync.record_changes(db, "prescriptions", prescription_ids)
+    db.commit()
+    # Reload the whole batch with one query instead of a refresh per row
+    return (
+        db.query(models.Prescription)
+        .filter(models.Prescription.prescription_id.in_(prescription_ids))
+        .order_by(models.Prescription.prescription_id)
+        .all()
+    )
+
+def get_prescriptions_for_patient(db: Session, patient_id: int, include_archived: bool = False, fieldset=None):
+    """Current prescriptions for a patient; archived ones are only read when asked for."""
+    prescriptions = (
+        _with_fieldset(db.query(models.Prescription), models.Prescription, fieldset)
+        .filter(models.Prescription.patient_id == patient_id)
+        .all()
+    )
+    if include_archived:
+        prescriptions += (
+            _with_fieldset(db.query(models.PrescriptionArchive), models.PrescriptionArchive, fieldset)
+            .filter(models.PrescriptionArchive.patient_id == patient_id)
+            .all()
+        )
+    return prescriptions
+
+def get_medications_for_patient(db: Session, patient_id: int) -> List[str]:
+    """The patient's current medications: those prescribed within ACTIVE_PRESCRIPTION_DAYS."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.ACTIVE_PRESCRIPTION_DAYS)
+    return [
+        medication for (medication,) in
+        db.query(models.Prescription.medication).filter(
+            models.Prescription.patient_id == patient_id,
+            models.Prescription.created_at >= cutoff
+        )
+    ]
 
 
 
@@ -122,9 +367,16 @@ def create_document(db: Session, patient_id: int, file_name: str, file_path: str
         document_name=file_name,
         storage_path=file_path,
         uploaded_by=user_id,
-        document_type=document_type
+        document_type=document_type,
+        processing_status='pending'
     )
     db.add(db_document)
+    db.flush()
+    search.index_document(db, db_document)
+    sync.record_change(db, "documents", db_document.document_id)
+    # Enqueue the scan in the same transaction so a document is never stored
+    # without its jobs.
+    _enqueue_document_jobs(db, db_document.document_id, ["virus_scan"])
     db.commit()
     db.refresh(db_document)
     return db_document
@@ -133,3 +385,162 @@ def get_documents_for_patient(db: Session, patient_id: int):
 
     return db.query(models.Document).filter(models.Document.patient_id == patient_id).all()
 
+def get_document(db: Session, document_id: int):
+
+    return db.query(models.Document).filter(models.Document.document_id == document_id).first()
+
+def get_jobs_for_document(db: Session, document_id: int):
+
+    return db.query(models.Job).filter(models.Job.document_id == document_id).order_by(models.Job.job_id).all()
+
+
+
+def _enqueue_document_jobs(db: Session, document_id: int, job_types: List[str]):
+    for job_type in job_types:
+        db.add(models.Job(
+            job_type=job_type,
+            document_id=document_id,
+            max_attempts=settings.JOB_MAX_ATTEMPTS
+        ))
+
+def claim_next_job(db: Session):
+    """
+    Claims the oldest runnable job for this worker.
+
+    The row is locked with SKIP LOCKED so concurrent workers never pick up the
+    same job and never block on each other.
+    """
+    db_job = (
+        db.query(models.Job)
+        .filter(models.Job.status == 'queued', models.Job.run_after <= func.now())
+        .order_by(models.Job.run_after, models.Job.job_id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if db_job:
+        db_job.status = 'running'
+        db_job.attempts += 1
+        if db_job.document is not None:
+            db_job.document.processing_status = 'processing'
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+def complete_job(db: Session, db_job: models.Job, document_updates: Dict):
+    """Marks a job as done and stores whatever the handler produced on its document."""
+    db_job.status = 'done'
+    db_job.last_error = None
+    if db_job.document is not None:
+        for key, value in document_updates.items():
+            setattr(db_job.document, key, value)
+        if "extracted_text" in document_updates:
+            search.index_document(db, db_job.document)
+        if db_job.job_type == 'virus_scan' and db_job.document.scan_result in SAFE_SCAN_RESULTS:
+            _enqueue_document_jobs(db, db_job.document_id, POST_SCAN_JOB_TYPES)
+    db.flush()
+    _update_document_processing_status(db, db_job.document)
+    if db_job.document_id is not None:
+        sync.record_change(db, "documents", db_job.document_id)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def fail_job(db: Session, db_job: models.Job, error: str):
+    """Reschedules a failed job with exponential backoff, or gives up after max_attempts."""
+    db_job.last_error = error
+    if db_job.attempts >= db_job.max_attempts:
+        db_job.status = 'failed'
+    else:
+        delay = settings.JOB_BACKOFF_BASE_SECONDS * (2 ** (db_job.attempts - 1))
+        db_job.status = 'queued'
+        db_job.run_after = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    db.flush()
+    _update_document_processing_status(db, db_job.document)
+    if db_job.document_id is not None:
+        sync.record_change(db, "documents", db_job.document_id)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def defer_job(db: Session, db_job: models.Job, delay: timedelta):
+    """Puts a claimed job back on the queue without counting the attempt."""
+    db_job.status = 'queued'
+    db_job.attempts -= 1
+    db_job.run_after = datetime.now(timezone.utc) + delay
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def requeue_stale_jobs(db: Session, older_than: timedelta):
+    """
+    Puts jobs left 'running' by a crashed worker back on the queue, or marks
+    them failed once they have used up their attempts, so a job that keeps
+    crashing workers is not retried forever.
+    """
+    cutoff = datetime.now(timezone.utc) - older_than
+    stale_jobs = (
+        db.query(models.Job)
+        .filter(models.Job.status == 'running', models.Job.updated_at < cutoff)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for db_job in stale_jobs:
+        if db_job.attempts >= db_job.max_attempts:
+            db_job.status = 'failed'
+            db_job.last_error = "Worker lease expired (worker crashed or timed out)"
+        else:
+            db_job.status = 'queued'
+    db.flush()
+    for db_job in stale_jobs:
+        if db_job.status == 'failed':
+            _update_document_processing_status(db, db_job.document)
+            if db_job.document_id is not None:
+                sync.record_change(db, "documents", db_job.document_id)
+    db.commit()
+    return len(stale_jobs)
+
+def _update_document_processing_status(db: Session, db_document: Optional[models.Document]):
+    if db_document is None:
+        return
+    statuses = {
+        status for (status,) in
+        db.query(models.Job.status).filter(models.Job.document_id == db_document.document_id)
+    }
+    if db_document.scan_result == 'infected':
+        db_document.processing_status = 'infected'
+    elif 'failed' in statuses:
+        db_document.processing_status = 'failed'
+    elif statuses == {'done'}:
+        db_document.processing_status = 'processed'
+    else:
+        db_document.processing_status = 'processing'
+
+
+def get_audit_events(
+    db: Session,
+    patient_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    skip: int = 0,
+    limit: int = 100,
+    user_facility_id: Optional[str] = None
+):
+    """
+    Audit events, newest first, filtered by patient and/or user. A user is
+    identified by `user_id` within `user_facility_id`, which defaults to the
+    facility whose audit trail is queried.
+    """
+    query = db.query(models.AuditEvent)
+    if patient_id is not None:
+        query = query.filter(models.AuditEvent.patient_id == patient_id)
+    if user_id is not None:
+        query = query.filter(
+            models.AuditEvent.user_facility_id == (user_facility_id or db.info["facility"]),
+            models.AuditEvent.user_id == user_id
+        )
+    if since is not None:
+        query = query.filter(models.AuditEvent.occurred_at >= since)
+    if until is not None:
+        query = query.filter(models.AuditEvent.occurred_at < until)
+    return query.order_by(models.AuditEvent.occurred_at.desc()).offset(skip).limit(limit).all()
@@ -1,23 +1,310 @@
+import hashlib
+import itertools
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, TypeVar
+from fastapi import HTTPException, Request, status
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from dotenv import load_dotenv
 
+from . import security
+
 env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../.env'))
 load_dotenv(dotenv_path=env_path)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Facility shards
+#
+# Every facility (hospital) keeps its users and patient data in its own
+# database. FACILITY_DATABASE_URLS maps facility codes to database URLs, e.g.
+# "north=postgresql://db-north/hms,south=postgresql://db-south/hms". The
+# DEFAULT_FACILITY is served from DATABASE_URL unless it is listed there too.
+# Each facility must have a database of its own: cross-facility queries visit
+# every shard once.
+DEFAULT_FACILITY = os.getenv("DEFAULT_FACILITY", "main")
+FACILITY_DATABASE_URLS = {DEFAULT_FACILITY: DATABASE_URL}
+for _entry in os.getenv("FACILITY_DATABASE_URLS", "").split(","):
+    _facility, _, _url = _entry.partition("=")
+    if _facility.strip() and _url.strip():
+        FACILITY_DATABASE_URLS[_facility.strip()] = _url.strip()
+
+# Connections each facility's pool hands out at once (per process); admission
+# control keeps part of them for clinical routes
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_CAPACITY = DB_POOL_SIZE + DB_MAX_OVERFLOW
+
+
+def _create_facility_engine(url: str):
+    if url.startswith("sqlite"):
+        return create_engine(url)
+    return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+
+facility_engines = {facility: _create_facility_engine(url) for facility, url in FACILITY_DATABASE_URLS.items()}
+# Session.info["facility"] tells crud which facility a session belongs to
+facility_sessions = {
+    facility: sessionmaker(autocommit=False, autoflush=False, bind=shard_engine, info={"facility": facility})
+    for facility, shard_engine in facility_engines.items()
+}
+
+engine = facility_engines[DEFAULT_FACILITY]
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = facility_sessions[DEFAULT_FACILITY]
 
 Base = declarative_base()
 
-def get_db():
 
-    db = SessionLocal()
+def home_facility(request: Request) -> str:
+    """The caller's own facility, from the facility claim of its bearer token."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        except JWTError:
+            payload = {}
+        # Tokens issued before facilities existed belong to the default facility
+        return payload.get("facility") or DEFAULT_FACILITY
+    return DEFAULT_FACILITY
+
+
+def request_facility(request: Request) -> str:
+    """
+    Facility whose shard serves the request: the one named in the X-Facility
+    header, otherwise the caller's own. Anonymous callers (public booking) use
+    the header to pick a hospital. get_current_user only lets admins reach
+    facilities other than their own.
+    """
+    facility = request.headers.get("x-facility") or home_facility(request)
+    if facility not in facility_sessions:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown facility '{facility}'")
+    return facility
+
+
+def _request_session(request: Request, facility: str):
+    # One session per shard per request, shared by every dependency that asks for it
+    sessions = getattr(request.state, "db_sessions", None)
+    if sessions is None:
+        sessions = request.state.db_sessions = {}
+    if facility in sessions:
+        yield sessions[facility]
+        return
+    db = sessions[facility] = facility_sessions[facility]()
+    try:
+        yield db
+    finally:
+        del sessions[facility]
+        db.close()
+
+
+def get_db(request: Request):
+    """Session on the shard of the facility the request is for."""
+    yield from _request_session(request, request_facility(request))
+
+
+def get_home_db(request: Request):
+    """Session on the caller's own shard, where its user record lives."""
+    facility = home_facility(request)
+    if facility not in facility_sessions:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    yield from _request_session(request, facility)
+
+
+T = TypeVar("T")
+
+_fan_out_pool = ThreadPoolExecutor(max_workers=max(4, len(facility_sessions)), thread_name_prefix="shard-fan-out")
+
+
+def fan_out(query: Callable[[Session], T], facilities: Optional[Iterable[str]] = None) -> Dict[str, T]:
+    """
+    Runs `query(db)` on every facility shard (or the given ones) in parallel
+    and returns the results by facility, in FACILITY_DATABASE_URLS order.
+
+    Each shard's session is closed when its query returns, so the query must
+    load everything the caller will read from the returned rows.
+    """
+    def run(facility: str) -> T:
+        with facility_sessions[facility]() as db:
+            return query(db)
+
+    facilities = list(facilities or facility_sessions)
+    if len(facilities) == 1:
+        return {facilities[0]: run(facilities[0])}
+    return dict(zip(facilities, _fan_out_pool.map(run, facilities)))
+
+
+# Read replicas
+#
+# REPLICA_DATABASE_URLS is a comma-separated list of replicas of the default
+# facility's database; other facilities read from their own shard. Read-only
+# endpoints use get_read_db, which picks a replica whose replication lag is
+# within MAX_REPLICA_LAG_SECONDS. A client that has just written is pinned to
+# the primary for READ_YOUR_WRITES_SECONDS so it always sees its own changes;
+# with several API processes the last writes are kept in Redis
+# (READ_YOUR_WRITES_REDIS_URL, by default RATE_LIMIT_REDIS_URL) so that every
+# process knows about them. Lag is measured by a background thread, so an
+# unreachable replica never holds up a request.
+REPLICA_DATABASE_URLS = [url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()]
+MAX_REPLICA_LAG_SECONDS = float(os.getenv("MAX_REPLICA_LAG_SECONDS", 5))
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL_SECONDS", 2))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 10))
+REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv("REPLICA_CONNECT_TIMEOUT_SECONDS", 2))
+READ_YOUR_WRITES_REDIS_URL = os.getenv("READ_YOUR_WRITES_REDIS_URL", os.getenv("RATE_LIMIT_REDIS_URL", ""))
+
+logger = logging.getLogger("hms.database")
+
+
+def _create_replica_engine(url: str):
+    connect_args = {}
+    if url.startswith("postgresql"):
+        connect_args["connect_timeout"] = REPLICA_CONNECT_TIMEOUT_SECONDS
+    return create_engine(url, connect_args=connect_args)
+
+
+replica_engines = [_create_replica_engine(url) for url in REPLICA_DATABASE_URLS]
+replica_sessions = [
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, info={"facility": DEFAULT_FACILITY})
+    for replica_engine in replica_engines
+]
+
+_replica_cycle = itertools.cycle(range(len(replica_sessions)))
+_replica_lag = {}  # replica index -> lag in seconds, or None if unreachable
+_lag_monitor: Optional[threading.Thread] = None
+_last_write_at = {}  # client key -> time.monotonic() of its last write, without Redis
+_lock = threading.Lock()
+
+_write_redis = None
+if replica_sessions and READ_YOUR_WRITES_REDIS_URL:
+    import redis
+
+    _write_redis = redis.from_url(
+        READ_YOUR_WRITES_REDIS_URL,
+        socket_timeout=REPLICA_CONNECT_TIMEOUT_SECONDS,
+        socket_connect_timeout=REPLICA_CONNECT_TIMEOUT_SECONDS,
+    )
+
+
+def client_key(request: Request) -> str:
+    """Identifies the caller for read-your-writes: a hash of its bearer token, or its address if anonymous."""
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+    return request.client.host if request.client else ""
+
+
+def record_write(request: Request):
+    """Pins this client to the primary for READ_YOUR_WRITES_SECONDS."""
+    if not replica_sessions:
+        return
+    if _write_redis is not None:
+        try:
+            _write_redis.set(
+                f"last_write:{client_key(request)}", 1, px=int(READ_YOUR_WRITES_SECONDS * 1000)
+            )
+        except Exception:
+            logger.exception("Could not record the write in Redis")
+        return
+    now = time.monotonic()
+    with _lock:
+        _last_write_at[client_key(request)] = now
+        # Drop expired entries so the map only holds recently active writers
+        if len(_last_write_at) > 10000:
+            for key, written_at in list(_last_write_at.items()):
+                if now - written_at > READ_YOUR_WRITES_SECONDS:
+                    del _last_write_at[key]
+
+
+def _wrote_recently(request: Request) -> bool:
+    if _write_redis is not None:
+        try:
+            return bool(_write_redis.exists(f"last_write:{client_key(request)}"))
+        except Exception:
+            # Unknown, so read from the primary to be safe
+            logger.exception("Could not look up the last write in Redis")
+            return True
+    written_at = _last_write_at.get(client_key(request))
+    return written_at is not None and time.monotonic() - written_at <= READ_YOUR_WRITES_SECONDS
+
+
+def _measure_lag(index: int) -> Optional[float]:
+    replica_engine = replica_engines[index]
+    try:
+        with replica_engine.connect() as connection:
+            if replica_engine.dialect.name != "postgresql":
+                connection.execute(text("SELECT 1"))
+                return 0.0
+            # A replica that is streaming from the primary and has replayed
+            # everything it received is caught up, however long ago the last
+            # transaction on the primary was. Otherwise (including when its WAL
+            # receiver is disconnected) the age of the last replayed
+            # transaction is its lag.
+            lag = connection.execute(text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                "AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+                "END"
+            )).scalar()
+            return float(lag)
+    except Exception:
+        return None
+
+
+def _monitor_replica_lag():
+    while True:
+        for index in range(len(replica_engines)):
+            _replica_lag[index] = _measure_lag(index)
+        time.sleep(REPLICA_LAG_CHECK_INTERVAL_SECONDS)
+
+
+def _start_lag_monitor():
+    global _lag_monitor
+    with _lock:
+        if _lag_monitor is None:
+            _lag_monitor = threading.Thread(target=_monitor_replica_lag, name="replica-lag", daemon=True)
+            _lag_monitor.start()
+
+
+def _pick_replica() -> Optional[sessionmaker]:
+    _start_lag_monitor()
+    for _ in range(len(replica_sessions)):
+        index = next(_replica_cycle)
+        # Not measured yet counts as unavailable, the primary serves until then
+        lag = _replica_lag.get(index)
+        if lag is not None and lag <= MAX_REPLICA_LAG_SECONDS:
+            return replica_sessions[index]
+    return None
+
+
+def get_read_db(request: Request):
+    """
+    Session for read-only endpoints.
+
+    Uses a healthy replica when one is configured, and falls back to the
+    primary when none is within the lag limit or the client wrote recently.
+    """
+    facility = request_facility(request)
+    session_factory = None
+    if replica_sessions and facility == DEFAULT_FACILITY:
+        if not _wrote_recently(request):
+            session_factory = _pick_replica()
+    if session_factory is None:
+        yield from _request_session(request, facility)
+        return
+
+    db = session_factory()
     try:
         yield db
     finally:
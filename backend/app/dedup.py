@@ -0,0 +1,262 @@
+"""
+Patient record linkage (duplicate detection).
+
+Comparing every patient with every other one is infeasible, so patients are
+grouped into blocks by a blocking key, date of birth plus the Soundex code of
+the surname, stored in `Patient.match_key`. Only patients in the same block
+are compared. Within a block all pairs are scored at once with numpy:
+
+* names (character bigrams) and addresses (trigrams) become hashed n-gram
+  vectors, so a single matrix product gives the cosine similarity of every
+  pair. Bigrams tolerate spelling variants such as Jonathan/Jonathon;
+* phone numbers and gender are compared exactly.
+
+The score is a weighted average over the fields both records have filled in.
+
+`find_matches` is the fast pre-insert check used by `POST /patients/`. The
+full scan runs across all CPU cores:
+
+    python -m app.dedup
+"""
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import re
+from datetime import date
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger("hms.dedup")
+
+VECTOR_DIMENSIONS = 512
+FIELD_WEIGHTS = {"name": 0.55, "address": 0.1, "phone": 0.25, "gender": 0.1}
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+# (patient_id, full_name, gender, contact_number, address)
+PatientRow = Tuple[int, str, Optional[str], Optional[str], Optional[str]]
+
+
+def soundex(word: str) -> str:
+    """American Soundex code, e.g. 'Robert' -> 'R163'."""
+    letters = re.sub(r"[^a-z]", "", word.lower())
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code, vowels do
+        if letter not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def match_key(full_name: str, date_of_birth: date) -> str:
+    """Blocking key: date of birth plus Soundex of the surname (last name token)."""
+    tokens = full_name.split()
+    surname = tokens[-1] if tokens else ""
+    return f"{date_of_birth.isoformat()}:{soundex(surname)}"
+
+
+def _normalize_text(value: Optional[str]) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", (value or "").lower()))
+
+
+def _normalize_phone(value: Optional[str]) -> str:
+    digits = re.sub(r"\D", "", value or "")
+    # Compare the subscriber part so country/area prefixes do not matter
+    return digits[-7:]
+
+
+def _ngram_vectors(values: Sequence[str], n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalized hashed character n-gram vectors, plus a mask of which values were present."""
+    vectors = np.zeros((len(values), VECTOR_DIMENSIONS), dtype=np.float32)
+    present = np.zeros(len(values), dtype=bool)
+    for row, value in enumerate(values):
+        if not value:
+            continue
+        present[row] = True
+        padded = " " * (n - 1) + value + " "
+        for i in range(len(padded) - n + 1):
+            digest = hashlib.blake2b(padded[i:i + n].encode(), digest_size=4).digest()
+            vectors[row, int.from_bytes(digest, "little") % VECTOR_DIMENSIONS] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors, present
+
+
+def _exact_match(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairwise equality matrix and a mask of pairs where both values are present."""
+    array = np.array(values, dtype=object)
+    present = array != ""
+    equal = (array[:, None] == array[None, :]).astype(np.float32)
+    return equal, present[:, None] & present[None, :]
+
+
+def score_matrix(rows: Sequence[PatientRow]) -> np.ndarray:
+    """Similarity (0-1) of every pair of patients in a block."""
+    names = [_normalize_text(row[1]) for row in rows]
+    genders = [_normalize_text(row[2]) for row in rows]
+    phones = [_normalize_phone(row[3]) for row in rows]
+    addresses = [_normalize_text(row[4]) for row in rows]
+
+    name_vectors, _ = _ngram_vectors(names, 2)
+    address_vectors, address_present = _ngram_vectors(addresses, 3)
+    phone_equal, phone_both = _exact_match(phones)
+    gender_equal, gender_both = _exact_match(genders)
+
+    weighted = FIELD_WEIGHTS["name"] * (name_vectors @ name_vectors.T)
+    total_weight = np.full(weighted.shape, FIELD_WEIGHTS["name"], dtype=np.float32)
+
+    address_both = address_present[:, None] & address_present[None, :]
+    weighted += FIELD_WEIGHTS["address"] * (address_vectors @ address_vectors.T) * address_both
+    total_weight += FIELD_WEIGHTS["address"] * address_both
+    weighted += FIELD_WEIGHTS["phone"] * phone_equal * phone_both
+    total_weight += FIELD_WEIGHTS["phone"] * phone_both
+    weighted += FIELD_WEIGHTS["gender"] * gender_equal * gender_both
+    total_weight += FIELD_WEIGHTS["gender"] * gender_both
+
+    return weighted / total_weight
+
+
+def score_block(rows: Sequence[PatientRow], threshold: float = settings.DEDUP_THRESHOLD) -> List[Tuple[int, int, float]]:
+    """Returns (patient_id, duplicate_id, score) for every pair in the block above the threshold."""
+    if len(rows) < 2:
+        return []
+    scores = score_matrix(rows)
+    first, second = np.nonzero(np.triu(scores >= threshold, k=1))
+    return [
+        (rows[i][0], rows[j][0], float(scores[i, j]))
+        for i, j in zip(first.tolist(), second.tolist())
+    ]
+
+
+def _row(patient) -> PatientRow:
+    return (patient.patient_id, patient.full_name, patient.gender, patient.contact_number, patient.address)
+
+
+def find_matches(
+    db: Session,
+    full_name: str,
+    date_of_birth: date,
+    gender: Optional[str] = None,
+    contact_number: Optional[str] = None,
+    address: Optional[str] = None,
+    threshold: float = settings.DEDUP_THRESHOLD,
+) -> List[Tuple[models.Patient, float]]:
+    """Existing patients that probably match the given details, best match first."""
+    candidates = (
+        db.query(models.Patient)
+        .filter(models.Patient.match_key == match_key(full_name, date_of_birth))
+        .all()
+    )
+    if not candidates:
+        return []
+    rows = [(0, full_name, gender, contact_number, address)] + [_row(p) for p in candidates]
+    scores = score_matrix(rows)[0, 1:]
+    matches = [(patient, float(score)) for patient, score in zip(candidates, scores) if score >= threshold]
+    return sorted(matches, key=lambda match: match[1], reverse=True)
+
+
+def backfill_match_keys(db: Session, batch_size: int = 1000) -> int:
+    """Computes match_key for patients registered before it existed."""
+    updated = 0
+    while True:
+        patients = (
+            db.query(models.Patient)
+            .filter(models.Patient.match_key.is_(None))
+            .limit(batch_size)
+            .all()
+        )
+        if not patients:
+            return updated
+        for patient in patients:
+            patient.match_key = match_key(patient.full_name, patient.date_of_birth)
+        db.commit()
+        updated += len(patients)
+
+
+def _blocks(db: Session, batch_size: int) -> Iterable[List[PatientRow]]:
+    """Streams blocks of patients sharing a match_key, using the match_key index for ordering."""
+    rows = (
+        db.query(
+            models.Patient.match_key,
+            models.Patient.patient_id,
+            models.Patient.full_name,
+            models.Patient.gender,
+            models.Patient.contact_number,
+            models.Patient.address,
+        )
+        .order_by(models.Patient.match_key, models.Patient.patient_id)
+        .yield_per(batch_size)
+    )
+    for _, block in itertools.groupby(rows, key=lambda row: row[0]):
+        block = [tuple(row[1:]) for row in block]
+        if len(block) > 1:
+            yield block
+
+
+def find_all_duplicates(db: Session, processes: Optional[int] = None, batch_size: int = 5000) -> int:
+    """
+    Scores every block on all CPU cores and replaces the open duplicate candidates.
+
+    Returns the number of candidate pairs found.
+    """
+    backfill_match_keys(db)
+
+    pairs = []
+    with multiprocessing.Pool(processes=processes) as pool:
+        for block_pairs in pool.imap_unordered(score_block, _blocks(db, batch_size), chunksize=64):
+            pairs.extend(block_pairs)
+
+    # Keep dismissed pairs dismissed, only refresh what is still open
+    reviewed = {
+        (patient_id, duplicate_id) for patient_id, duplicate_id in
+        db.query(models.DuplicateCandidate.patient_id, models.DuplicateCandidate.duplicate_id)
+        .filter(models.DuplicateCandidate.status != 'open')
+    }
+    db.query(models.DuplicateCandidate).filter(models.DuplicateCandidate.status == 'open').delete()
+    db.add_all(
+        models.DuplicateCandidate(patient_id=patient_id, duplicate_id=duplicate_id, score=score)
+        for patient_id, duplicate_id, score in pairs
+        if (patient_id, duplicate_id) not in reviewed
+    )
+    db.commit()
+    return len(pairs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import facility_engines, facility_sessions
+
+    parser = argparse.ArgumentParser(description="Find probable duplicate patients.")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all CPU cores)")
+    parser.add_argument("--facility", choices=list(facility_sessions), action="append", help="Facility to process, may be repeated (default: all)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    # Patients are matched within a facility, each facility's records live on its own shard
+    for facility in args.facility or facility_sessions:
+        models.Base.metadata.create_all(bind=facility_engines[facility])
+        with facility_sessions[facility]() as db:
+            found = find_all_duplicates(db, processes=args.processes)
+        logger.info("Found %s probable duplicate pairs in facility %s", found, facility)
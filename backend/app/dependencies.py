@@ -1,14 +1,17 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from . import crud, models, schemas, security
-from .database import get_db
+from .database import get_home_db, request_facility
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+STAFF_ROLES = ("doctor", "nurse")
+ROLES = STAFF_ROLES + ("admin",)
+
 def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+    request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_home_db)
 ) -> models.User:
     
     credentials_exception = HTTPException(
@@ -32,6 +35,10 @@ def get_current_user(
     user = crud.get_user_by_email(db, email=token_data.email)
     if user is None:
         raise credentials_exception
+
+    # Staff only see their own facility's data, admins may pick another one via X-Facility
+    if request_facility(request) != user.facility_id and user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions for this facility.")
     
     return user
 
@@ -43,7 +50,13 @@ def get_current_active_doctor(current_user: models.User = Depends(get_current_us
 
 def get_current_active_staff(current_user: models.User = Depends(get_current_user)):
   
-    if current_user.role not in ["doctor", "nurse"]:
+    if current_user.role not in STAFF_ROLES:
         raise HTTPException(status_code=403, detail="Not enough permissions, Doctor or Nurse role required.")
     return current_user
 
+
+def get_current_admin(current_user: models.User = Depends(get_current_user)):
+
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions, Admin role required.")
+    return current_user
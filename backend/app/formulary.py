@@ -0,0 +1,165 @@
+"""
+In-memory formulary for medication interaction and duplicate-therapy checks.
+
+The formulary is a JSON file (see `settings.FORMULARY_PATH`) that is loaded
+once into dictionaries keyed by drug name, so a check is a handful of dict
+lookups. The file's modification time is checked on access and the index is
+rebuilt when it changes, so the formulary can be updated without a restart.
+If the changed file cannot be loaded (missing, invalid or half written), the
+last formulary that loaded keeps being served and the load is retried every
+FORMULARY_RETRY_SECONDS.
+"""
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger("hms.formulary")
+
+# Severities that block prescribing unless the doctor explicitly overrides
+BLOCKING_SEVERITIES = {"major", "contraindicated"}
+
+FORMULARY_RETRY_SECONDS = 5
+
+
+class Formulary:
+
+    def __init__(self, data: Dict):
+        self.drug_classes: Dict[str, str] = {}
+        self.names: Dict[str, str] = {}
+        self.interactions: Dict[FrozenSet[str], Dict] = {}
+
+        for drug in data.get("drugs", []):
+            name = drug["name"].lower()
+            self.drug_classes[name] = drug.get("therapeutic_class")
+            self.names[name] = name
+            for alias in drug.get("aliases", []):
+                self.names[alias.lower()] = name
+
+        for interaction in data.get("interactions", []):
+            pair = frozenset(self.names.get(d.lower(), d.lower()) for d in interaction["drugs"])
+            self.interactions[pair] = interaction
+
+        # Longest first so "acetylsalicylic acid" wins over any shorter alias
+        self._multi_word_names = sorted(
+            (n for n in self.names if " " in n), key=len, reverse=True
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "Formulary":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def resolve(self, medication: str) -> Optional[str]:
+        """
+        Maps free-text medication (e.g. "Warfarin 5mg tablets") to a formulary drug name.
+        """
+        normalized = " ".join(re.findall(r"[a-z0-9]+", medication.lower()))
+        if normalized in self.names:
+            return self.names[normalized]
+        for word in normalized.split():
+            if word in self.names:
+                return self.names[word]
+        padded = f" {normalized} "
+        for name in self._multi_word_names:
+            if f" {name} " in padded:
+                return self.names[name]
+        return None
+
+    def check(self, medications: Iterable[str], existing: Iterable[str] = ()) -> List[Dict]:
+        """
+        Checks new medications against each other and against the patient's existing ones.
+
+        Returns a list of warnings; pairs made only of existing medications are
+        not reported again.
+        """
+        new = [(m, self.resolve(m)) for m in medications]
+        current = [(m, self.resolve(m)) for m in existing]
+        new = [(m, d) for m, d in new if d]
+        current = [(m, d) for m, d in current if d]
+
+        pairs = list(itertools.combinations(new, 2)) + list(itertools.product(new, current))
+        warnings = []
+        for (med_a, drug_a), (med_b, drug_b) in pairs:
+            if drug_a == drug_b:
+                warnings.append({
+                    "type": "duplicate_therapy",
+                    "severity": "major",
+                    "medications": [med_a, med_b],
+                    "description": f"{drug_a} is prescribed more than once.",
+                })
+                continue
+
+            interaction = self.interactions.get(frozenset((drug_a, drug_b)))
+            if interaction:
+                warnings.append({
+                    "type": "interaction",
+                    "severity": interaction["severity"],
+                    "medications": [med_a, med_b],
+                    "description": interaction["description"],
+                })
+
+            drug_class = self.drug_classes.get(drug_a)
+            if drug_class and drug_class == self.drug_classes.get(drug_b):
+                warnings.append({
+                    "type": "duplicate_therapy",
+                    "severity": "moderate",
+                    "medications": [med_a, med_b],
+                    "description": f"Both medications are in the same therapeutic class ({drug_class}).",
+                })
+        return warnings
+
+
+_lock = threading.Lock()
+_formulary: Optional[Formulary] = None
+_loaded_mtime: Optional[float] = None
+_retry_at = 0.0  # time.monotonic() before which a failed reload is not retried
+
+
+def _file_mtime() -> Optional[float]:
+    try:
+        return os.stat(settings.FORMULARY_PATH).st_mtime
+    except OSError:
+        return None
+
+
+def get_formulary() -> Formulary:
+    """
+    Returns the loaded formulary, reloading it first if the file has changed.
+
+    Raises only if no formulary has loaded yet.
+    """
+    global _formulary, _loaded_mtime, _retry_at
+    mtime = _file_mtime()
+    if _formulary is None or (mtime != _loaded_mtime and time.monotonic() >= _retry_at):
+        with _lock:
+            if _formulary is None or (mtime != _loaded_mtime and time.monotonic() >= _retry_at):
+                try:
+                    _formulary = Formulary.from_file(settings.FORMULARY_PATH)
+                    _loaded_mtime = mtime
+                except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                    if _formulary is None:
+                        raise
+                    logger.exception("Failed to reload the formulary, still serving the previous one")
+                    _retry_at = time.monotonic() + FORMULARY_RETRY_SECONDS
+    return _formulary
+
+
+def reload_formulary() -> Formulary:
+    """
+    Forces the formulary to be re-read from disk. If that fails the error is
+    raised and the previous formulary stays in use.
+    """
+    global _formulary, _loaded_mtime, _retry_at
+    with _lock:
+        mtime = os.stat(settings.FORMULARY_PATH).st_mtime
+        _formulary = Formulary.from_file(settings.FORMULARY_PATH)
+        _loaded_mtime = mtime
+        _retry_at = 0.0
+    return _formulary
@@ -1,7 +1,11 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from .database import engine
+from .audit import audit_log
+from .compression import CompressionMiddleware
+from .database import facility_engines, record_write
+from .ratelimit import AdmissionControlMiddleware
 from . import models
 from .routers import (
     auth,
@@ -9,10 +13,15 @@ from .routers import (
     appointments,
     beds,
     prescriptions,
-    documents
+    documents,
+    search,
+    audit,
+    sync,
+    facilities
 )
 
-models.Base.metadata.create_all(bind=engine)
+for shard_engine in facility_engines.values():
+    models.Base.metadata.create_all(bind=shard_engine)
 
 
 app = FastAPI(
@@ -26,6 +35,9 @@ origins = [
     "http://localhost:3000",  
 ]
 
+# Added before CORS so shed responses still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,12 +46,36 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def track_writes(request: Request, call_next):
+    # Reads from this client go to the primary for a short while after a write
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        await run_in_threadpool(record_write, request)
+    return response
+
 app.include_router(auth.router)
 app.include_router(patients.router)
 app.include_router(appointments.router)
 app.include_router(beds.router)
 app.include_router(prescriptions.router)
 app.include_router(documents.router)
+app.include_router(search.router)
+app.include_router(audit.router)
+app.include_router(sync.router)
+app.include_router(facilities.router)
+
+
+@app.on_event("startup")
+def start_audit_log():
+    audit_log.start()
+
+@app.on_event("shutdown")
+def flush_audit_log():
+    # Write out buffered audit events before the process exits
+    audit_log.stop()
 
 
 @app.get("/", tags=["Root"])
@@ -7,11 +7,15 @@ from sqlalchemy import (
     Boolean,
     ForeignKey,
     TIMESTAMP,
-    Text
+    Text,
+    Float,
+    Index,
+    UniqueConstraint
 )
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
-from .database import Base
+from sqlalchemy.dialects import postgresql  # noqa: F401 - registers to_tsvector() and friends
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.sql import func, literal_column
+from .database import Base, DEFAULT_FACILITY
 
 class User(Base):
     __tablename__ = "users"
@@ -21,6 +25,7 @@ class User(Base):
     password_hash = Column(String(255), nullable=False)
     full_name = Column(String(255), nullable=False)
     role = Column(String(50), nullable=False)
+    facility_id = Column(String(50), nullable=False, index=True, default=DEFAULT_FACILITY)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
    
@@ -41,6 +46,8 @@ class Patient(Base):
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     presenting_complaint = Column(Text, nullable=True)
     triage_level = Column(String(50), nullable=True)
+    match_key = Column(String(64), nullable=True, index=True)  # Blocking key for duplicate detection
+    facility_id = Column(String(50), nullable=False, index=True, default=DEFAULT_FACILITY)  # Shard the record lives on
 
     
     registrar = relationship("User", back_populates="registered_patients")
@@ -72,10 +79,15 @@ class Document(Base):
     storage_path = Column(String(255), nullable=False)
     uploaded_by = Column(Integer, ForeignKey("users.user_id"))
     uploaded_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    processing_status = Column(String(50), default='pending')
+    scan_result = Column(String(50), nullable=True)
+    thumbnail_path = Column(String(255), nullable=True)
+    extracted_text = deferred(Column(Text, nullable=True))  # Can be large, only load on demand
 
     
     patient = relationship("Patient", back_populates="documents")
     uploader = relationship("User", back_populates="uploaded_documents")
+    jobs = relationship("Job", back_populates="document")
 
 class Prescription(Base):
     __tablename__ = "prescriptions"
@@ -88,6 +100,12 @@ class Prescription(Base):
     instructions = Column(Text)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_prescriptions_patient_id_created_at", "patient_id", "created_at"),
+        # Archived rows keep their ids, so SQLite must never hand them out again
+        {"sqlite_autoincrement": True},
+    )
+
     patient = relationship("Patient", back_populates="prescriptions")
     doctor = relationship("User", back_populates="prescribed")
 
@@ -103,6 +121,161 @@ class Appointment(Base):
     status = Column(String(50), default='pending')
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_appointments_appointment_date", "appointment_date"),
+        # Archived rows keep their ids, so SQLite must never hand them out again
+        {"sqlite_autoincrement": True},
+    )
    
     patient = relationship("Patient", back_populates="appointments")
 
+
+# Archive tables
+#
+# Appointments and prescriptions past their retention window are moved here by
+# archive.py, so the hot tables (and their indexes) only hold recent rows.
+# Rows keep their original primary keys.
+
+class PrescriptionArchive(Base):
+    __tablename__ = "prescriptions_archive"
+
+    prescription_id = Column(Integer, primary_key=True, autoincrement=False)
+    patient_id = Column(Integer, ForeignKey("patients.patient_id"), nullable=False)
+    doctor_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    medication = Column(Text, nullable=False)
+    dosage = Column(String(100))
+    instructions = Column(Text)
+    created_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        Index("ix_prescriptions_archive_patient_id_created_at", "patient_id", "created_at"),
+    )
+
+    patient = relationship("Patient")
+    doctor = relationship("User")
+
+
+class AppointmentArchive(Base):
+    __tablename__ = "appointments_archive"
+
+    appointment_id = Column(Integer, primary_key=True, autoincrement=False)
+    patient_id = Column(Integer, ForeignKey("patients.patient_id"), nullable=False, index=True)
+    doctor_id = Column(Integer, ForeignKey("users.user_id"), nullable=True)
+    appointment_date = Column(TIMESTAMP(timezone=True), nullable=False)
+    reason = Column(Text)
+    status = Column(String(50))
+    created_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        Index("ix_appointments_archive_appointment_date", "appointment_date"),
+    )
+
+    patient = relationship("Patient")
+
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    job_id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String(50), nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.document_id"), nullable=True, index=True)
+    status = Column(String(50), default='queued', nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_after = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Workers poll for the oldest runnable job, so keep that lookup indexed.
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
+
+    document = relationship("Document", back_populates="jobs")
+
+
+class DuplicateCandidate(Base):
+    """A pair of patients that are probably the same person, found by dedup.py."""
+    __tablename__ = "duplicate_candidates"
+
+    candidate_id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("patients.patient_id", ondelete="CASCADE"), nullable=False, index=True)
+    duplicate_id = Column(Integer, ForeignKey("patients.patient_id", ondelete="CASCADE"), nullable=False, index=True)
+    score = Column(Float, nullable=False)
+    status = Column(String(20), default='open', nullable=False)  # open, dismissed
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "duplicate_id", name="uq_duplicate_candidates_pair"),
+    )
+
+
+class Change(Base):
+    """
+    Change feed for delta sync. Holds the latest change per record; change_id
+    is the sync token and only ever increases (see sync.py).
+    """
+    __tablename__ = "changes"
+
+    change_id = Column(Integer, primary_key=True)
+    entity = Column(String(50), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)  # 'upsert' or 'delete'
+    changed_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("entity", "entity_id", name="uq_changes_entity"),
+        # Rows are replaced on every change, SQLite must not hand out the deleted max id again
+        {"sqlite_autoincrement": True},
+    )
+
+
+class AuditEvent(Base):
+    """Who read or changed which patient's record. Written in batches by audit.py."""
+    __tablename__ = "audit_events"
+
+    audit_id = Column(Integer, primary_key=True)
+    occurred_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    user_id = Column(Integer, nullable=True)
+    # User ids are only unique within a facility; an admin's reads of other
+    # facilities are logged there under the admin's own facility
+    user_facility_id = Column(String(50), nullable=True)
+    patient_id = Column(Integer, nullable=True)
+    action = Column(String(20), nullable=False)
+    resource = Column(String(50), nullable=False)
+    resource_id = Column(Integer, nullable=True)
+    client_address = Column(String(64), nullable=True)
+
+    # No foreign keys: the audit trail must outlive the rows it refers to
+    __table_args__ = (
+        Index("ix_audit_events_patient_id_occurred_at", "patient_id", "occurred_at"),
+        Index("ix_audit_events_user_occurred_at", "user_facility_id", "user_id", "occurred_at"),
+    )
+
+
+# Text search configuration of the queries in search.py; must match the one
+# the stored content_tsv column is generated with (see search.py)
+SEARCH_TS_CONFIG = literal_column("'english'::regconfig")
+
+
+class SearchEntry(Base):
+    """
+    One row of searchable text per indexed record (document or prescription).
+
+    On PostgreSQL a stored generated column holds the content's tsvector,
+    indexed with GIN; on SQLite an FTS5 table mirrors it (see search.py).
+    """
+    __tablename__ = "search_entries"
+
+    search_id = Column(Integer, primary_key=True, index=True)
+    source_type = Column(String(50), nullable=False)
+    source_id = Column(Integer, nullable=False)
+    patient_id = Column(Integer, ForeignKey("patients.patient_id"), nullable=False, index=True)
+    content = Column(Text, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("source_type", "source_id", name="uq_search_entries_source"),
+    )
@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+from typing import Dict
+
+from PIL import Image
+from pypdf import PdfReader
+
+from .config import settings
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff", ".webp"}
+TEXT_EXTENSIONS = {".txt", ".csv", ".md"}
+
+
+def generate_thumbnail(storage_path: str) -> Dict:
+    """Writes a thumbnail next to image uploads. Other file types are left alone."""
+    if os.path.splitext(storage_path)[1].lower() not in IMAGE_EXTENSIONS:
+        return {}
+
+    thumbnail_dir = os.path.join(os.path.dirname(storage_path), "thumbnails")
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    thumbnail_path = os.path.join(
+        thumbnail_dir, os.path.splitext(os.path.basename(storage_path))[0] + ".png"
+    )
+    with Image.open(storage_path) as image:
+        image.thumbnail((settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE))
+        image.save(thumbnail_path, "PNG")
+    return {"thumbnail_path": thumbnail_path}
+
+
+def extract_text(storage_path: str) -> Dict:
+    """Pulls the plain text out of PDFs and text files."""
+    extension = os.path.splitext(storage_path)[1].lower()
+    if extension == ".pdf":
+        reader = PdfReader(storage_path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    elif extension in TEXT_EXTENSIONS:
+        with open(storage_path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    else:
+        return {}
+    # PostgreSQL text cannot hold NUL characters, which PDFs do produce
+    text = text.replace("\x00", "")
+    return {"extracted_text": text[:settings.EXTRACTED_TEXT_MAX_CHARS]}
+
+
+def scan_for_viruses(storage_path: str) -> Dict:
+    """
+    Scans the file with ClamAV.
+
+    Uses the `clamdscan` daemon client when it is installed and falls back to
+    `clamscan`. If neither is available the scan fails, so the document is
+    never parsed, unless ALLOW_UNSCANNED_DOCUMENTS records it as 'unscanned'.
+    """
+    scanner = shutil.which("clamdscan") or shutil.which("clamscan")
+    if scanner is None:
+        if settings.ALLOW_UNSCANNED_DOCUMENTS:
+            return {"scan_result": "unscanned"}
+        raise RuntimeError("No virus scanner installed (clamdscan or clamscan)")
+
+    result = subprocess.run(
+        [scanner, "--no-summary", storage_path],
+        capture_output=True,
+        text=True,
+        timeout=settings.VIRUS_SCAN_TIMEOUT_SECONDS,
+    )
+    # ClamAV exit codes: 0 = clean, 1 = virus found, 2 = error
+    if result.returncode == 0:
+        return {"scan_result": "clean"}
+    if result.returncode == 1:
+        return {"scan_result": "infected"}
+    raise RuntimeError(f"Virus scan failed: {result.stderr.strip() or result.stdout.strip()}")
+
+
+JOB_HANDLERS = {
+    "virus_scan": scan_for_viruses,
+    "thumbnail": generate_thumbnail,
+    "extract_text": extract_text,
+}
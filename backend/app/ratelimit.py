@@ -0,0 +1,177 @@
+"""
+Rate limiting and admission control.
+
+* `RateLimiter` is a per-client token bucket used as a route dependency. The
+  buckets live in memory, or in Redis when RATE_LIMIT_REDIS_URL is set so that
+  several API processes share them.
+* `AdmissionControlMiddleware` caps the number of requests in flight and sheds
+  load by priority: patient-facing routes are rejected first, clinical routes
+  (beds, patients, prescriptions, documents) last. The lower priorities are
+  capped below the database pool size, so clinical routes always have
+  connections left.
+
+Rejected requests get 429 (rate limited) or 503 (shed) with a Retry-After header.
+"""
+import itertools
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+
+from .config import settings
+from .database import DB_POOL_CAPACITY
+
+# Path prefixes that must keep working during a surge
+CLINICAL_PREFIXES = ("/beds", "/patients", "/prescriptions", "/documents")
+# Unauthenticated, patient-facing routes: (method, path prefix)
+PUBLIC_ROUTES = (("POST", "/appointments"),)
+# Clients tracked per RateLimiter when the buckets are kept in memory
+MAX_LOCAL_BUCKETS = 100000
+
+_REDIS_TOKEN_BUCKET = """
+local tokens_key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', tokens_key, 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', tokens_key, 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', tokens_key, math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def client_address(request: Request) -> str:
+    if settings.TRUST_FORWARDED_FOR:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    """
+    Token bucket per client address: `rate_per_minute` sustained with bursts of up to `burst`.
+
+    Use as a dependency: `Depends(RateLimiter("booking", 10, 5))`.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # client -> (tokens, updated_at)
+        self._redis = None
+        if settings.RATE_LIMIT_REDIS_URL:
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(settings.RATE_LIMIT_REDIS_URL)
+            self._script = self._redis.register_script(_REDIS_TOKEN_BUCKET)
+
+    def _take_local(self, key: str) -> float:
+        now = time.monotonic()
+        if key not in self._buckets and len(self._buckets) >= MAX_LOCAL_BUCKETS:
+            self._evict_buckets(now)
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    def _evict_buckets(self, now: float):
+        # A bucket that has refilled completely carries no state worth keeping
+        refill_seconds = self.burst / self.rate
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if now - updated_at > refill_seconds:
+                del self._buckets[key]
+        # Too many clients active at once: forget the oldest quarter so the
+        # map stays bounded and this full scan stays rare
+        if len(self._buckets) >= MAX_LOCAL_BUCKETS:
+            for key in list(itertools.islice(self._buckets, MAX_LOCAL_BUCKETS // 4)):
+                del self._buckets[key]
+
+    async def _take_shared(self, key: str) -> float:
+        allowed, tokens = await self._script(
+            keys=[f"ratelimit:{self.name}:{key}"],
+            args=[self.rate, self.burst, time.time()],
+        )
+        if allowed:
+            return 0.0
+        return (1 - float(tokens)) / self.rate
+
+    async def __call__(self, request: Request):
+        key = client_address(request)
+        if self._redis is not None:
+            retry_after = await self._take_shared(key)
+        else:
+            retry_after = self._take_local(key)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+def request_priority(method: str, path: str) -> str:
+    for public_method, prefix in PUBLIC_ROUTES:
+        if method == public_method and path.startswith(prefix):
+            return "public"
+    if path.startswith(CLINICAL_PREFIXES):
+        return "clinical"
+    return "default"
+
+
+class AdmissionControlMiddleware:
+    """
+    Rejects requests with 503 once too many are in flight.
+
+    Each lower priority may only start while the total in-flight count is
+    below its share of `max_concurrent` or of the database pool, whichever is
+    smaller, so the last slots and database connections are always kept for
+    clinical routes.
+    """
+
+    def __init__(self, app, max_concurrent: Optional[int] = None, pool_capacity: Optional[int] = None):
+        self.app = app
+        self.max_concurrent = max_concurrent or settings.MAX_CONCURRENT_REQUESTS
+        shared = min(self.max_concurrent, pool_capacity or DB_POOL_CAPACITY)
+        self.limits = {
+            "public": max(1, int(shared * settings.PUBLIC_CONCURRENCY_SHARE)),
+            "default": max(1, int(shared * settings.DEFAULT_CONCURRENCY_SHARE)),
+            "clinical": self.max_concurrent,
+        }
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        priority = request_priority(scope["method"], scope["path"])
+        if self.in_flight >= self.limits[priority]:
+            response = JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"detail": "Server is busy, please try again shortly."},
+                headers={"Retry-After": str(settings.SHED_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+
+        # The counter is only touched from the event loop, so no lock is needed
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
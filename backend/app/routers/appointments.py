@@ -1,17 +1,31 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 
 from .. import crud, schemas, models
-from ..database import get_db
+from ..audit import audit_log
+from ..database import get_db, get_read_db
+from ..config import settings
 from ..dependencies import get_current_active_staff
+from ..fieldsets import Fieldset
+from ..ratelimit import RateLimiter
 
 router = APIRouter(
     prefix="/appointments",
     tags=["Appointments"]
 )
 
-@router.post("/", response_model=schemas.Appointment, status_code=status.HTTP_201_CREATED)
+APPOINTMENT_RELATIONS = {"patient": schemas.Patient}
+
+booking_rate_limit = RateLimiter("booking", settings.BOOKING_RATE_PER_MINUTE, settings.BOOKING_BURST)
+
+@router.post(
+    "/",
+    response_model=schemas.Appointment,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(booking_rate_limit)]
+)
 def create_appointment_request(
     appointment: schemas.AppointmentCreate,
     db: Session = Depends(get_db)
@@ -20,7 +34,8 @@ def create_appointment_request(
     Creates a new appointment request.
 
     This is a public endpoint that patients can use to request an appointment.
-    The initial status will be 'pending'.
+    The initial status will be 'pending'. Requests are rate limited per
+    client address and answered with 429 and `Retry-After` when exceeded.
     """
     # In a real-world scenario, you'd want to verify the patient_id exists
     # but for this minimal setup, we'll proceed directly.
@@ -29,18 +44,38 @@ def create_appointment_request(
 
 @router.get("/", response_model=List[schemas.Appointment])
 def read_appointments(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    day: Optional[date] = None,
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db),
     current_user: models.User = Depends(get_current_active_staff) # Secure this endpoint
 ):
     """
     Retrieves a list of all appointments.
 
     This endpoint is accessible only by authenticated staff (doctors/nurses)
-    and supports pagination.
+    and supports pagination. Pass `day` to get a single day's clinic list.
+    Appointments past the archive window are only included when
+    `include_archived` is set or `day` falls inside the archived period.
+
+    Use `fields` to return only some fields and `expand=patient` (or nested
+    fields such as `patient.full_name`) to embed the patient.
     """
-    appointments = crud.get_appointments(db, skip=skip, limit=limit)
+    fieldset = Fieldset.parse(schemas.Appointment, APPOINTMENT_RELATIONS, fields, expand)
+    appointments = crud.get_appointments(
+        db, skip=skip, limit=limit, day=day, include_archived=include_archived, fieldset=fieldset
+    )
+    if fieldset is None or fieldset.selects("patient") or fieldset.selects("patient_id"):
+        audit_log.record_many(
+            "read", "appointment", current_user.user_id,
+            [(a.patient_id, a.appointment_id) for a in appointments], request=request
+        )
+    if fieldset is not None:
+        return fieldset.serialize(appointments)
     return appointments
 
 @router.put("/{appointment_id}/status", response_model=schemas.Appointment)
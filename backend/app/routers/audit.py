@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..database import get_read_db
+from ..dependencies import get_current_admin
+
+router = APIRouter(
+    prefix="/audit",
+    tags=["Audit"],
+    dependencies=[Depends(get_current_admin)] # Audit trail is admin-only
+)
+
+@router.get("/", response_model=List[schemas.AuditEvent])
+def read_audit_events(
+    patient_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    user_facility_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    skip: int = 0,
+    limit: int = Query(100, le=1000),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Retrieves the audit trail of patient data access, newest first.
+
+    Filter by `patient_id` to see who accessed a patient's record, or by
+    `user_id` to see what a staff member accessed. Events are kept per
+    facility; send the X-Facility header to read another facility's trail.
+    User ids are per facility: pass `user_facility_id` to look up a user of
+    another facility (e.g. an admin) in this trail.
+    """
+    return crud.get_audit_events(
+        db, patient_id=patient_id, user_id=user_id, since=since, until=until, skip=skip, limit=limit,
+        user_facility_id=user_facility_id
+    )
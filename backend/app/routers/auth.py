@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from ..dependencies import get_current_user
+from ..dependencies import STAFF_ROLES, get_current_user
 
 from .. import crud, schemas, security, models
-from ..database import get_db
+from ..database import DEFAULT_FACILITY, facility_sessions
 
 router = APIRouter(
     prefix="/auth",
@@ -12,25 +11,32 @@ router = APIRouter(
 )
 
 @router.post("/signup", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def create_user(user: schemas.UserCreate):
     """
     Handles user registration.
 
-    Checks if a user with the given email already exists. If not, it creates
-    a new user in the database.
+    Checks if a user with the given email already exists in any facility. If
+    not, it creates a new doctor or nurse in the default facility. Admins and
+    staff of other facilities are created by an admin via
+    `POST /facilities/{facility_id}/users`.
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
+    if user.role not in STAFF_ROLES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Role '{user.role}' cannot be self-registered"
+        )
+    db_user = crud.find_user_by_email(email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    return crud.create_user(db=db, user=user)
+    with facility_sessions[DEFAULT_FACILITY]() as db:
+        return crud.create_user(db=db, user=user)
 
 
 @router.post("/token", response_model=schemas.Token)
 def login_for_access_token(
-    db: Session = Depends(get_db),
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """
@@ -39,7 +45,7 @@ def login_for_access_token(
     Authenticates the user with their email (as username) and password.
     If credentials are correct, a new access token is generated.
     """
-    user = crud.get_user_by_email(db, email=form_data.username)
+    user = crud.find_user_by_email(email=form_data.username)
     if not user or not security.verify_password(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -47,8 +53,9 @@ def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # The 'sub' (subject) of the token is the user's email
-    access_token = security.create_access_token(data={"sub": user.email})
+    # The 'sub' (subject) of the token is the user's email, 'facility' routes
+    # the user's requests to their facility's database
+    access_token = security.create_access_token(data={"sub": user.email, "facility": user.facility_id})
     
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -1,10 +1,12 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 
 from .. import crud, schemas, models
-from ..database import get_db
+from ..audit import audit_log
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_active_staff
+from ..fieldsets import Fieldset
 
 router = APIRouter(
     prefix="/beds",
@@ -12,25 +14,43 @@ router = APIRouter(
     dependencies=[Depends(get_current_active_staff)] # Secure all routes
 )
 
+BED_RELATIONS = {"patient": schemas.Patient}
+
 @router.get("/", response_model=List[schemas.Bed])
 def read_beds(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_staff)
 ):
     """
     Retrieves a list of all beds and their occupancy status.
     
-    Supports pagination.
+    Supports pagination. Use `fields` (e.g. `fields=bed_id,bed_number,is_occupied`)
+    to return only some fields; the patient is then only embedded with
+    `expand=patient` or when named, e.g. `fields=bed_number,patient.full_name`.
     """
-    beds = crud.get_beds(db, skip=skip, limit=limit)
+    fieldset = Fieldset.parse(schemas.Bed, BED_RELATIONS, fields, expand)
+    beds = crud.get_beds(db, skip=skip, limit=limit, fieldset=fieldset)
+    if fieldset is None or fieldset.selects("patient") or fieldset.selects("patient_id"):
+        audit_log.record_many(
+            "read", "bed", current_user.user_id,
+            [(b.patient_id, b.bed_id) for b in beds if b.patient_id is not None], request=request
+        )
+    if fieldset is not None:
+        return fieldset.serialize(beds)
     return beds
 
 @router.put("/{bed_id}", response_model=schemas.Bed)
 def update_bed_allocation(
     bed_id: int,
     bed_update: schemas.BedUpdate,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
 ):
     """
     Updates a bed's status (e.g., assign or unassign a patient).
@@ -47,5 +67,12 @@ def update_bed_allocation(
         if db_patient is None:
             raise HTTPException(status_code=404, detail="Patient to be assigned not found")
 
-    return crud.update_bed(db=db, bed_id=bed_id, bed_update=bed_update)
+    # Both the patient leaving the bed and the one assigned to it are affected
+    affected_patients = {db_bed.patient_id, bed_update.patient_id} - {None}
+    updated_bed = crud.update_bed(db=db, bed_id=bed_id, bed_update=bed_update)
+    audit_log.record_many(
+        "update", "bed", current_user.user_id,
+        [(patient_id, bed_id) for patient_id in affected_patients], request=request
+    )
+    return updated_bed
 
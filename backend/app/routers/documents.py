@@ -8,11 +8,13 @@ from fastapi import (
     Form,
     UploadFile,
     HTTPException,
+    Request,
     status
 )
 from sqlalchemy.orm import Session
 
 from .. import crud, schemas, models
+from ..audit import audit_log
 from ..database import get_db
 from ..dependencies import get_current_active_staff
 
@@ -29,6 +31,7 @@ if not os.path.exists(UPLOAD_DIRECTORY):
 
 @router.post("/upload", response_model=schemas.Document, status_code=status.HTTP_201_CREATED)
 def upload_document(
+    request: Request,
     patient_id: int = Form(...),
     document_type: str = Form(...),
     file: UploadFile = File(...),
@@ -39,7 +42,9 @@ def upload_document(
     Handles the upload of a document for a specific patient.
 
     The file is saved to a local directory, and its metadata is stored
-    in the database.
+    in the database. Virus scanning, thumbnailing and text extraction are
+    queued for the background worker, so the response returns immediately
+    with a 'pending' processing status.
     """
     # Verify the patient exists
     db_patient = crud.get_patient(db, patient_id=patient_id)
@@ -60,7 +65,7 @@ def upload_document(
         file.file.close()
 
     # Create the document record in the database
-    return crud.create_document(
+    db_document = crud.create_document(
         db=db,
         patient_id=patient_id,
         file_name=file.filename,
@@ -68,12 +73,18 @@ def upload_document(
         user_id=current_user.user_id,
         document_type=document_type
     )
+    audit_log.record(
+        "create", "document", current_user.user_id, patient_id, db_document.document_id, request=request
+    )
+    return db_document
 
 
 @router.get("/patient/{patient_id}", response_model=List[schemas.Document])
 def read_documents_for_patient(
     patient_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
 ):
     """
     Retrieves all document records for a specific patient.
@@ -82,5 +93,22 @@ def read_documents_for_patient(
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    return crud.get_documents_for_patient(db=db, patient_id=patient_id)
+    documents = crud.get_documents_for_patient(db=db, patient_id=patient_id)
+    audit_log.record("read", "documents", current_user.user_id, patient_id, request=request)
+    return documents
+
+
+
+@router.get("/{document_id}/jobs", response_model=List[schemas.Job])
+def read_document_jobs(
+    document_id: int,
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieves the post-processing jobs for a document, including retry state.
+    """
+    db_document = crud.get_document(db, document_id=document_id)
+    if not db_document:
+        raise HTTPException(status_code=404, detail="Document not found")
 
+    return crud.get_jobs_for_document(db=db, document_id=document_id)
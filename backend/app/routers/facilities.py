@@ -0,0 +1,65 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from .. import crud, schemas, models
+from ..audit import audit_log
+from ..database import facility_sessions
+from ..dependencies import ROLES, get_current_admin
+
+router = APIRouter(
+    prefix="/facilities",
+    tags=["Facilities"],
+    dependencies=[Depends(get_current_admin)] # Cross-facility views are admin-only
+)
+
+@router.get("/", response_model=List[schemas.FacilitySummary])
+def read_facilities():
+    """
+    Lists every facility with its patient count and bed occupancy.
+
+    The counts are queried from all facility databases in parallel.
+    """
+    return crud.get_facility_summaries()
+
+
+@router.post("/{facility_id}/users", response_model=schemas.User, status_code=status.HTTP_201_CREATED)
+def create_facility_user(facility_id: str, user: schemas.UserCreate):
+    """
+    Creates a staff account (doctor, nurse or admin) in the given facility.
+
+    Public signup only creates doctors and nurses in the default facility, so
+    this is how other facilities get their staff and how admins are added.
+    """
+    if facility_id not in facility_sessions:
+        raise HTTPException(status_code=404, detail=f"Unknown facility '{facility_id}'")
+    if user.role not in ROLES:
+        raise HTTPException(status_code=400, detail=f"Unknown role '{user.role}'")
+    if crud.find_user_by_email(email=user.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    with facility_sessions[facility_id]() as db:
+        return crud.create_user(db=db, user=user)
+
+
+@router.get("/patients/", response_model=List[schemas.Patient])
+def read_patients_all_facilities(
+    request: Request,
+    name: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(100, le=1000),
+    current_user: models.User = Depends(get_current_admin)
+):
+    """
+    Retrieves patients of all facilities, most recently registered first.
+
+    Patient IDs are only unique within a facility; `facility_id` tells which
+    facility a patient belongs to. Filter by `name` to find a patient across
+    hospitals.
+    """
+    patients = crud.get_patients_all_facilities(skip=skip, limit=limit, name=name)
+    # Each facility's audit trail gets the reads of its own patients
+    by_facility = {}
+    for p in patients:
+        by_facility.setdefault(p.facility_id, []).append((p.patient_id, p.patient_id))
+    for facility, targets in by_facility.items():
+        audit_log.record_many("read", "patient", current_user.user_id, targets, request=request, facility=facility)
+    return patients
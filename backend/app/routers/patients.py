@@ -1,10 +1,12 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 
-from .. import crud, schemas, models
-from ..database import get_db
+from .. import crud, dedup, schemas, models
+from ..audit import audit_log
+from ..database import get_db, get_read_db
 from ..dependencies import get_current_active_staff
+from ..fieldsets import Fieldset
 
 router = APIRouter(
     prefix="/patients",
@@ -15,6 +17,8 @@ router = APIRouter(
 @router.post("/", response_model=schemas.Patient)
 def create_patient(
     patient: schemas.PatientCreate,
+    request: Request,
+    allow_duplicate: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_staff)
 ):
@@ -23,45 +27,137 @@ def create_patient(
 
     This endpoint is accessible only by authenticated staff (doctors/nurses).
     The `registered_by` field is automatically set to the current user's ID.
+
+    If the patient probably already exists, 409 is returned with the likely
+    matches. Resubmit with `allow_duplicate=true` to register anyway.
     """
-    return crud.create_patient(db=db, patient=patient, user_id=current_user.user_id)
+    if not allow_duplicate:
+        matches = dedup.find_matches(db, **patient.model_dump(exclude={"presenting_complaint"}))
+        if matches:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "message": "Patient may already be registered",
+                    "matches": [
+                        schemas.PatientMatch(patient=match, score=score).model_dump(mode="json")
+                        for match, score in matches
+                    ]
+                }
+            )
+
+    db_patient = crud.create_patient(db=db, patient=patient, user_id=current_user.user_id)
+    audit_log.record("create", "patient", current_user.user_id, db_patient.patient_id, request=request)
+    return db_patient
 
 
 @router.get("/", response_model=List[schemas.Patient])
 def read_patients(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_staff)
 ):
     """
     Retrieves a list of all patients.
 
     This endpoint supports pagination using `skip` and `limit` query parameters.
+    Use `fields` (e.g. `fields=patient_id,full_name,triage_level`) to return
+    only some fields.
     """
-    patients = crud.get_patients(db, skip=skip, limit=limit)
+    fieldset = Fieldset.parse(schemas.Patient, {}, fields, None)
+    patients = crud.get_patients(db, skip=skip, limit=limit, fieldset=fieldset)
+    audit_log.record_many(
+        "read", "patient", current_user.user_id,
+        [(p.patient_id, p.patient_id) for p in patients], request=request
+    )
+    if fieldset is not None:
+        return fieldset.serialize(patients)
     return patients
 
 
+@router.get("/duplicates/", response_model=List[schemas.DuplicateCandidate])
+def read_duplicate_candidates(
+    skip: int = 0,
+    limit: int = 100,
+    status: str = 'open',
+    db: Session = Depends(get_read_db)
+):
+    """
+    Lists probable duplicate patients found by the batch job (`python -m app.dedup`), best match first.
+    """
+    return crud.get_duplicate_candidates(db, skip=skip, limit=limit, status=status)
+
+@router.put("/duplicates/{candidate_id}/dismiss", response_model=schemas.DuplicateCandidate)
+def dismiss_duplicate_candidate(candidate_id: int, db: Session = Depends(get_db)):
+    """Marks a candidate pair as not the same person so it is not reported again."""
+    db_candidate = crud.dismiss_duplicate_candidate(db, candidate_id=candidate_id)
+    if db_candidate is None:
+        raise HTTPException(status_code=404, detail="Duplicate candidate not found")
+    return db_candidate
+
+@router.post("/{patient_id}/merge", response_model=schemas.Patient)
+def merge_patient(
+    patient_id: int,
+    merge: schemas.PatientMerge,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
+    """
+    Merges a duplicate patient record into this one.
+
+    Prescriptions, documents, appointments and the bed allocation of the
+    duplicate are moved to this patient and the duplicate is deleted.
+    """
+    if merge.duplicate_id == patient_id:
+        raise HTTPException(status_code=400, detail="Cannot merge a patient into itself")
+
+    db_patient = crud.merge_patients(db, patient_id=patient_id, duplicate_id=merge.duplicate_id)
+    if db_patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    audit_log.record("merge", "patient", current_user.user_id, patient_id, merge.duplicate_id, request=request)
+    audit_log.record("merge", "patient", current_user.user_id, merge.duplicate_id, patient_id, request=request)
+    return db_patient
+
 @router.get("/{patient_id}", response_model=schemas.Patient)
-def read_patient(patient_id: int, db: Session = Depends(get_db)):
+def read_patient(
+    patient_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
     """
     Retrieves a single patient by their ID.
     """
     db_patient = crud.get_patient(db, patient_id=patient_id)
     if db_patient is None:
         raise HTTPException(status_code=404, detail="Patient not found")
+    audit_log.record("read", "patient", current_user.user_id, patient_id, patient_id, request=request)
     return db_patient
 
 @router.get("/alerts/high-priority", response_model=List[schemas.Patient])
-def read_high_priority_alerts(db: Session = Depends(get_db)):
+def read_high_priority_alerts(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
     """Retrieves patients with high-priority triage levels."""
-    return crud.get_high_priority_patients(db)
+    patients = crud.get_high_priority_patients(db)
+    audit_log.record_many(
+        "read", "patient", current_user.user_id,
+        [(p.patient_id, p.patient_id) for p in patients], request=request
+    )
+    return patients
 
 @router.put("/{patient_id}/triage", response_model=schemas.Patient)
 def update_triage(
     patient_id: int,
     triage_update: schemas.TriageUpdate,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
 ):
     """Updates a patient's triage level."""
     db_patient = crud.update_patient_triage_level(
@@ -69,4 +165,5 @@ def update_triage(
     )
     if db_patient is None:
         raise HTTPException(status_code=404, detail="Patient not found")
+    audit_log.record("update", "triage", current_user.user_id, patient_id, patient_id, request=request)
     return db_patient
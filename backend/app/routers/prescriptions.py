@@ -1,19 +1,25 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 
 from .. import crud, schemas, models
+from ..audit import audit_log
 from ..database import get_db
 from ..dependencies import get_current_active_doctor, get_current_active_staff
+from ..fieldsets import Fieldset
+from ..formulary import BLOCKING_SEVERITIES, get_formulary, reload_formulary
 
 router = APIRouter(
     prefix="/prescriptions",
     tags=["Prescriptions"]
 )
 
+PRESCRIPTION_RELATIONS = {"patient": schemas.Patient, "doctor": schemas.User}
+
 @router.post("/", response_model=schemas.Prescription, status_code=status.HTTP_201_CREATED)
 def create_prescription(
     prescription: schemas.PrescriptionCreate,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_doctor) # Only doctors can create
 ):
@@ -27,12 +33,21 @@ def create_prescription(
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
         
-    return crud.create_prescription(db=db, prescription=prescription, doctor_id=current_user.user_id)
+    db_prescription = crud.create_prescription(db=db, prescription=prescription, doctor_id=current_user.user_id)
+    audit_log.record(
+        "create", "prescription", current_user.user_id,
+        db_prescription.patient_id, db_prescription.prescription_id, request=request
+    )
+    return db_prescription
 
 
 @router.get("/patient/{patient_id}", response_model=List[schemas.Prescription])
 def read_prescriptions_for_patient(
     patient_id: int,
+    request: Request,
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_staff) # Staff can view
 ):
@@ -40,10 +55,99 @@ def read_prescriptions_for_patient(
     Retrieves all prescriptions for a specific patient.
 
     This endpoint is accessible by all authenticated staff (doctors and nurses).
+    Prescriptions moved to the archive are only included with `include_archived`.
+
+    Use `fields` to return only some fields and `expand=doctor,patient` (or
+    nested fields such as `doctor.full_name`) to embed related records.
     """
+    fieldset = Fieldset.parse(schemas.Prescription, PRESCRIPTION_RELATIONS, fields, expand)
     db_patient = crud.get_patient(db, patient_id=patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    return crud.get_prescriptions_for_patient(db=db, patient_id=patient_id)
+    prescriptions = crud.get_prescriptions_for_patient(
+        db=db, patient_id=patient_id, include_archived=include_archived, fieldset=fieldset
+    )
+    audit_log.record("read", "prescriptions", current_user.user_id, patient_id, request=request)
+    if fieldset is not None:
+        return fieldset.serialize(prescriptions)
+    return prescriptions
+
+
+
+@router.post("/check", response_model=List[schemas.InteractionWarning])
+def check_prescriptions(
+    check: schemas.PrescriptionCheck,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
+    """
+    Checks medications for interactions and duplicate therapy without saving anything.
+
+    The medications are checked against each other and against the patient's
+    current prescriptions (written within ACTIVE_PRESCRIPTION_DAYS) using the
+    locally loaded formulary.
+    """
+    db_patient = crud.get_patient(db, patient_id=check.patient_id)
+    if not db_patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    existing = crud.get_medications_for_patient(db, patient_id=check.patient_id)
+    audit_log.record("read", "prescriptions", current_user.user_id, check.patient_id, request=request)
+    return get_formulary().check(check.medications, existing)
+
+
+@router.post("/batch", response_model=schemas.PrescriptionBatch, status_code=status.HTTP_201_CREATED)
+def create_prescription_batch(
+    batch: schemas.PrescriptionBatchCreate,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_doctor) # Only doctors can create
+):
+    """
+    Creates a whole order set (e.g. discharge medications) for a patient in one transaction.
+
+    The order set is checked for interactions and duplicate therapy first. If
+    any major or contraindicated warning is found the request is rejected with
+    409 unless `override_warnings` is set; warnings are always returned.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=422, detail="At least one prescription is required")
+
+    db_patient = crud.get_patient(db, patient_id=batch.patient_id)
+    if not db_patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    existing = crud.get_medications_for_patient(db, patient_id=batch.patient_id)
+    warnings = get_formulary().check([item.medication for item in batch.items], existing)
+    if not batch.override_warnings and any(w["severity"] in BLOCKING_SEVERITIES for w in warnings):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Medication safety check failed", "warnings": warnings}
+        )
+
+    prescriptions = crud.create_prescriptions(
+        db=db, patient_id=batch.patient_id, items=batch.items, doctor_id=current_user.user_id
+    )
+    audit_log.record_many(
+        "create", "prescription", current_user.user_id,
+        [(batch.patient_id, p.prescription_id) for p in prescriptions], request=request
+    )
+    return {"prescriptions": prescriptions, "warnings": warnings}
+
 
+@router.post("/formulary/reload", status_code=status.HTTP_204_NO_CONTENT)
+def reload_formulary_file(
+    current_user: models.User = Depends(get_current_active_doctor)
+):
+    """
+    Re-reads the formulary file. Changes are also picked up automatically on the next check.
+    """
+    try:
+        reload_formulary()
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Formulary not reloaded, the previous one is still in use: {exc}",
+        )
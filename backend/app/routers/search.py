@@ -0,0 +1,38 @@
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas, search, models
+from ..audit import audit_log
+from ..database import get_read_db
+from ..dependencies import get_current_active_staff
+
+router = APIRouter(
+    prefix="/search",
+    tags=["Search"],
+    dependencies=[Depends(get_current_active_staff)] # Secure all routes
+)
+
+@router.get("/", response_model=List[schemas.SearchResult])
+def search_records(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    patient_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
+    """
+    Full-text search across prescriptions and uploaded document contents.
+
+    Results are ranked by relevance. Pass `patient_id` to restrict the search
+    to a single patient's records, or leave it out to search globally.
+    """
+    if patient_id is not None and crud.get_patient(db, patient_id=patient_id) is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    results = search.search(db, query=q, patient_id=patient_id, limit=limit)
+    # Snippets are patient data, log which records they came from
+    for result in results:
+        audit_log.record("read", result.source_type, current_user.user_id, result.patient_id, result.source_id, request=request)
+    return results
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy.orm import Session
+
+from .. import schemas, sync, models
+from ..audit import audit_log
+from ..database import get_read_db
+from ..dependencies import get_current_active_staff
+
+router = APIRouter(
+    prefix="/sync",
+    tags=["Sync"],
+    dependencies=[Depends(get_current_active_staff)] # Secure all routes
+)
+
+@router.get("/", response_model=schemas.SyncPage)
+def read_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=5000),
+    db: Session = Depends(get_read_db),
+    current_user: models.User = Depends(get_current_active_staff)
+):
+    """
+    Returns patients, beds, appointments, prescriptions and documents changed since `since`.
+
+    Start with `since=0` for a full sync, then pass back the returned `token`.
+    Each changed record appears once with its current state; deleted records
+    are listed by id under `deletes`. Keep calling while `has_more` is true.
+    """
+    page = sync.get_changes(db, since=since, limit=limit)
+    for entity, rows in page["upserts"].items():
+        _, primary_key = sync.SYNCED_ENTITIES[entity]
+        audit_log.record_many(
+            "read", entity, current_user.user_id,
+            [(row.patient_id, getattr(row, primary_key.key)) for row in rows if row.patient_id is not None],
+            request=request
+        )
+    return page
@@ -21,6 +21,7 @@ class UserCreate(UserBase):
 
 class User(UserBase):
     user_id: int
+    facility_id: str
     created_at: datetime
 
     class Config:
@@ -42,10 +43,28 @@ class Patient(PatientBase):
     registered_by: Optional[int] = None
     created_at: datetime
     triage_level: Optional[str] = None
+    facility_id: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class PatientMatch(BaseModel):
+    patient: Patient
+    score: float
+
+class DuplicateCandidate(BaseModel):
+    candidate_id: int
+    patient_id: int
+    duplicate_id: int
+    score: float
+    status: str
+
+    class Config:
+        from_attributes = True
+
+class PatientMerge(BaseModel):
+    duplicate_id: int
+
 class TriageUpdate(BaseModel):
     triage_level: Optional[str] = None
 
@@ -82,6 +101,22 @@ class Document(DocumentBase):
     storage_path: str
     uploaded_by: Optional[int] = None
     uploaded_at: datetime
+    processing_status: Optional[str] = None
+    scan_result: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class Job(BaseModel):
+    job_id: int
+    job_type: str
+    document_id: Optional[int] = None
+    status: str
+    attempts: int
+    max_attempts: int
+    run_after: datetime
+    last_error: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -106,6 +141,25 @@ class Prescription(PrescriptionBase):
     class Config:
         from_attributes = True
 
+class PrescriptionBatchCreate(BaseModel):
+    patient_id: int
+    items: List[PrescriptionBase]
+    override_warnings: bool = False
+
+class PrescriptionCheck(BaseModel):
+    patient_id: int
+    medications: List[str]
+
+class InteractionWarning(BaseModel):
+    type: str
+    severity: str
+    medications: List[str]
+    description: str
+
+class PrescriptionBatch(BaseModel):
+    prescriptions: List[Prescription]
+    warnings: List[InteractionWarning]
+
 
 
 class AppointmentBase(BaseModel):
@@ -129,3 +183,83 @@ class Appointment(AppointmentBase):
     class Config:
         from_attributes = True
 
+
+
+class SearchResult(BaseModel):
+    source_type: str
+    source_id: int
+    patient_id: int
+    rank: float
+    snippet: str
+
+    class Config:
+        from_attributes = True
+
+
+class AuditEvent(BaseModel):
+    audit_id: int
+    occurred_at: datetime
+    user_id: Optional[int] = None
+    user_facility_id: Optional[str] = None
+    patient_id: Optional[int] = None
+    action: str
+    resource: str
+    resource_id: Optional[int] = None
+    client_address: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class SyncBed(BedBase):
+    bed_id: int
+    patient_id: Optional[int] = None
+    last_updated: datetime
+
+    class Config:
+        from_attributes = True
+
+class SyncAppointment(AppointmentBase):
+    appointment_id: int
+    patient_id: int
+    doctor_id: Optional[int] = None
+    status: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SyncPrescription(PrescriptionBase):
+    prescription_id: int
+    patient_id: int
+    doctor_id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class SyncUpserts(BaseModel):
+    patients: List[Patient] = []
+    beds: List[SyncBed] = []
+    appointments: List[SyncAppointment] = []
+    prescriptions: List[SyncPrescription] = []
+    documents: List[Document] = []
+
+class SyncDeletes(BaseModel):
+    patients: List[int] = []
+    beds: List[int] = []
+    appointments: List[int] = []
+    prescriptions: List[int] = []
+    documents: List[int] = []
+
+class SyncPage(BaseModel):
+    token: int
+    has_more: bool
+    upserts: SyncUpserts
+    deletes: SyncDeletes
+
+class FacilitySummary(BaseModel):
+    facility_id: str
+    patients: int
+    beds: int
+    occupied_beds: int
@@ -0,0 +1,249 @@
+"""
+Full-text search over prescriptions and document contents.
+
+Every prescription and document gets one row in `search_entries`, written in
+the same transaction as the record itself (and refreshed by the worker once
+the document text has been extracted). Ranking is done by the database:
+
+* PostgreSQL: a stored generated `content_tsv` column with a GIN index,
+  ranked by `ts_rank` on that column, so queries never re-parse the content.
+* SQLite: an external-content FTS5 table kept in sync by triggers, ranked by
+  `bm25`. This is what local and test runs use.
+
+Existing data can be (re)indexed with:
+
+    python -m app.search --reindex
+"""
+import re
+from typing import List, Optional
+
+from sqlalchemy import DDL, event, literal_column, text
+from sqlalchemy.orm import Session, undefer
+from sqlalchemy.sql import func
+
+from . import models
+
+SNIPPET_WORDS = 20
+
+_SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_entries_fts USING fts5(
+        content, content='search_entries', content_rowid='search_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN
+        INSERT INTO search_entries_fts(rowid, content) VALUES (new.search_id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN
+        INSERT INTO search_entries_fts(search_entries_fts, rowid, content)
+        VALUES ('delete', old.search_id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_entries_au AFTER UPDATE ON search_entries BEGIN
+        INSERT INTO search_entries_fts(search_entries_fts, rowid, content)
+        VALUES ('delete', old.search_id, old.content);
+        INSERT INTO search_entries_fts(rowid, content) VALUES (new.search_id, new.content);
+    END
+    """,
+]
+
+_POSTGRESQL_TSV_DDL = [
+    """
+    ALTER TABLE search_entries ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english'::regconfig, content)) STORED
+    """,
+    # Expression index used before content_tsv existed
+    "DROP INDEX IF EXISTS ix_search_entries_content_tsv",
+    """
+    CREATE INDEX IF NOT EXISTS ix_search_entries_content_tsv_gin
+        ON search_entries USING gin (content_tsv)
+    """,
+]
+
+# Not mapped on the model: generated by the database, and PostgreSQL only
+_CONTENT_TSV = literal_column("search_entries.content_tsv")
+
+for statement in _SQLITE_FTS_DDL:
+    event.listen(
+        models.SearchEntry.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+
+for statement in _POSTGRESQL_TSV_DDL:
+    event.listen(
+        models.SearchEntry.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+
+
+def upgrade_postgresql(db: Session):
+    """Adds content_tsv and its index to a search_entries table created before they existed."""
+    for statement in _POSTGRESQL_TSV_DDL:
+        db.execute(text(statement))
+    db.commit()
+
+
+def _prescription_content(db_prescription: models.Prescription) -> str:
+    return " ".join(
+        part for part in (
+            db_prescription.medication,
+            db_prescription.dosage,
+            db_prescription.instructions,
+        ) if part
+    )
+
+
+def _document_content(db_document: models.Document) -> str:
+    return " ".join(
+        part for part in (
+            db_document.document_name,
+            db_document.document_type,
+            db_document.extracted_text,
+        ) if part
+    )
+
+
+def _upsert_entry(db: Session, source_type: str, source_id: int, patient_id: int, content: str):
+    db_entry = (
+        db.query(models.SearchEntry)
+        .filter(models.SearchEntry.source_type == source_type, models.SearchEntry.source_id == source_id)
+        .first()
+    )
+    if db_entry is None:
+        db_entry = models.SearchEntry(source_type=source_type, source_id=source_id)
+        db.add(db_entry)
+    db_entry.patient_id = patient_id
+    db_entry.content = content
+    return db_entry
+
+
+def index_prescription(db: Session, db_prescription: models.Prescription):
+    """Adds or refreshes the search entry for a prescription. Does not commit."""
+    return _upsert_entry(
+        db, "prescription", db_prescription.prescription_id,
+        db_prescription.patient_id, _prescription_content(db_prescription)
+    )
+
+
+def index_document(db: Session, db_document: models.Document):
+    """Adds or refreshes the search entry for a document. Does not commit."""
+    return _upsert_entry(
+        db, "document", db_document.document_id,
+        db_document.patient_id, _document_content(db_document)
+    )
+
+
+def _terms(query: str) -> List[str]:
+    return re.findall(r"\w+", query.lower())
+
+
+def _search_postgresql(db: Session, terms: List[str], patient_id: Optional[int], limit: int):
+    document = _CONTENT_TSV
+    query = func.plainto_tsquery(models.SEARCH_TS_CONFIG, " ".join(terms))
+    rank = func.ts_rank(document, query).label("rank")
+
+    ranked = (
+        db.query(
+            models.SearchEntry.source_type,
+            models.SearchEntry.source_id,
+            models.SearchEntry.patient_id,
+            models.SearchEntry.content,
+            rank,
+        )
+        .filter(document.op("@@")(query))
+    )
+    if patient_id is not None:
+        ranked = ranked.filter(models.SearchEntry.patient_id == patient_id)
+    ranked = ranked.order_by(rank.desc()).limit(limit).subquery()
+
+    # Only build headlines for the rows we return, ts_headline is expensive
+    snippet = func.ts_headline(
+        models.SEARCH_TS_CONFIG, ranked.c.content, query,
+        f"MaxWords={SNIPPET_WORDS}, MinWords=5, StartSel=<b>, StopSel=</b>"
+    )
+    rows = db.query(
+        ranked.c.source_type, ranked.c.source_id, ranked.c.patient_id, ranked.c.rank, snippet
+    ).order_by(ranked.c.rank.desc()).all()
+    return rows
+
+
+def _search_sqlite(db: Session, terms: List[str], patient_id: Optional[int], limit: int):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    match = " ".join(f'"{term}"' for term in terms)
+    sql = f"""
+        SELECT e.source_type, e.source_id, e.patient_id,
+               -bm25(search_entries_fts) AS rank,
+               snippet(search_entries_fts, 0, '<b>', '</b>', '...', {SNIPPET_WORDS}) AS snippet
+        FROM search_entries_fts
+        JOIN search_entries AS e ON e.search_id = search_entries_fts.rowid
+        WHERE search_entries_fts MATCH :match
+        {"AND e.patient_id = :patient_id" if patient_id is not None else ""}
+        ORDER BY bm25(search_entries_fts)
+        LIMIT :limit
+    """
+    params = {"match": match, "limit": limit}
+    if patient_id is not None:
+        params["patient_id"] = patient_id
+    return db.execute(text(sql), params).all()
+
+
+def search(db: Session, query: str, patient_id: Optional[int] = None, limit: int = 20):
+    """
+    Ranked search across prescriptions and documents.
+
+    Returns (source_type, source_id, patient_id, rank, snippet) rows, best
+    match first, optionally restricted to a single patient.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    if db.get_bind().dialect.name == "postgresql":
+        return _search_postgresql(db, terms, patient_id, limit)
+    return _search_sqlite(db, terms, patient_id, limit)
+
+
+def reindex_all(db: Session, batch_size: int = 1000):
+    """Rebuilds search entries for every prescription and document, one batch per commit."""
+    for model, primary_key, index in (
+        (models.Prescription, models.Prescription.prescription_id, index_prescription),
+        (models.Document, models.Document.document_id, index_document),
+    ):
+        last_id = 0
+        while True:
+            query = db.query(model).filter(primary_key > last_id).order_by(primary_key)
+            if model is models.Document:
+                query = query.options(undefer(models.Document.extracted_text))
+            batch = query.limit(batch_size).all()
+            if not batch:
+                break
+            for record in batch:
+                index(db, record)
+            db.commit()
+            last_id = getattr(batch[-1], primary_key.key)
+            db.expunge_all()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import facility_engines, facility_sessions
+
+    parser = argparse.ArgumentParser(description="Manage the full-text search index.")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the index from existing records")
+    parser.add_argument("--facility", choices=list(facility_sessions), action="append", help="Facility to process, may be repeated (default: all)")
+    args = parser.parse_args()
+
+    for facility in args.facility or facility_sessions:
+        models.Base.metadata.create_all(bind=facility_engines[facility])
+        with facility_sessions[facility]() as db:
+            if db.get_bind().dialect.name == "postgresql":
+                upgrade_postgresql(db)
+            if args.reindex:
+                reindex_all(db)
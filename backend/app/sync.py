@@ -0,0 +1,121 @@
+"""
+Change feed for offline-capable clients (ward tablets).
+
+Every write path in crud.py calls `record_changes` in the same transaction as
+the write. The `changes` table keeps only the latest change per record, so a
+client that syncs with `GET /sync?since=<token>` receives each changed record
+once, however often it changed, plus tombstones for deleted records.
+
+Tokens are `change_id` values. On PostgreSQL, writers take a transaction-level
+advisory lock before inserting into `changes`, so ids become visible in
+increasing order and a reader can never skip over a row that commits late.
+SQLite serializes writers already; there `changes` uses AUTOINCREMENT, as
+replacing the newest row would otherwise reuse its id as the next token.
+"""
+from typing import Dict, Iterable, List
+
+from sqlalchemy import delete, insert, text
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Arbitrary application-wide key for pg_advisory_xact_lock
+_CHANGE_LOG_LOCK_KEY = 7_301_033
+
+# entity name -> (model, primary key column)
+SYNCED_ENTITIES = {
+    "patients": (models.Patient, models.Patient.patient_id),
+    "beds": (models.Bed, models.Bed.bed_id),
+    "appointments": (models.Appointment, models.Appointment.appointment_id),
+    "prescriptions": (models.Prescription, models.Prescription.prescription_id),
+    "documents": (models.Document, models.Document.document_id),
+}
+
+
+def record_changes(db: Session, entity: str, entity_ids: Iterable[int], operation: str = "upsert"):
+    """Adds change feed entries for the given records. Does not commit."""
+    entity_ids = list(entity_ids)
+    if not entity_ids:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _CHANGE_LOG_LOCK_KEY})
+    db.execute(
+        delete(models.Change)
+        .where(models.Change.entity == entity, models.Change.entity_id.in_(entity_ids))
+    )
+    db.execute(
+        insert(models.Change),
+        [{"entity": entity, "entity_id": entity_id, "operation": operation} for entity_id in entity_ids]
+    )
+
+
+def record_change(db: Session, entity: str, entity_id: int, operation: str = "upsert"):
+    record_changes(db, entity, [entity_id], operation)
+
+
+def get_changes(db: Session, since: int, limit: int) -> Dict:
+    """
+    Returns up to `limit` changes after `since`, with the current state of
+    every changed record and the ids of deleted ones.
+    """
+    changes: List[models.Change] = (
+        db.query(models.Change)
+        .filter(models.Change.change_id > since)
+        .order_by(models.Change.change_id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    upserted: Dict[str, List[int]] = {entity: [] for entity in SYNCED_ENTITIES}
+    deleted: Dict[str, List[int]] = {entity: [] for entity in SYNCED_ENTITIES}
+    for change in changes:
+        target = deleted if change.operation == "delete" else upserted
+        target[change.entity].append(change.entity_id)
+
+    upserts = {}
+    for entity, ids in upserted.items():
+        model, primary_key = SYNCED_ENTITIES[entity]
+        upserts[entity] = db.query(model).filter(primary_key.in_(ids)).all() if ids else []
+
+    return {
+        "token": changes[-1].change_id if changes else since,
+        "has_more": has_more,
+        "upserts": upserts,
+        "deletes": deleted,
+    }
+
+
+def backfill_changes(db: Session, batch_size: int = 1000):
+    """Adds an upsert entry for every existing record, e.g. after enabling sync on an existing database."""
+    for entity, (model, primary_key) in SYNCED_ENTITIES.items():
+        last_id = 0
+        while True:
+            ids = [
+                row_id for (row_id,) in
+                db.query(primary_key).filter(primary_key > last_id).order_by(primary_key).limit(batch_size)
+            ]
+            if not ids:
+                break
+            record_changes(db, entity, ids)
+            db.commit()
+            last_id = ids[-1]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import facility_engines, facility_sessions
+
+    parser = argparse.ArgumentParser(description="Manage the sync change feed.")
+    parser.add_argument("--backfill", action="store_true", help="Add change entries for all existing records")
+    parser.add_argument("--facility", choices=list(facility_sessions), action="append", help="Facility to process, may be repeated (default: all)")
+    args = parser.parse_args()
+
+    for facility in args.facility or facility_sessions:
+        models.Base.metadata.create_all(bind=facility_engines[facility])
+        if not args.backfill:
+            continue
+        with facility_sessions[facility]() as db:
+            backfill_changes(db)
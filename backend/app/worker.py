@@ -0,0 +1,107 @@
+"""
+Background worker for document post-processing.
+
+Run one or more of these next to the API:
+
+    python -m app.worker [--facility CODE]
+
+A worker serves one facility's database (the default facility unless
+--facility is given), so run at least one per facility. Jobs are stored
+in the `jobs` table, so no external broker is needed. Each worker claims
+jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker
+processes can share the queue. Jobs left running by a crashed worker are
+put back on the queue once their lease (JOB_LEASE_SECONDS) has expired.
+"""
+import logging
+import signal
+import time
+from datetime import timedelta
+
+from . import crud, models
+from .config import settings
+from .database import DEFAULT_FACILITY, facility_engines, facility_sessions
+from .processing import JOB_HANDLERS
+
+logger = logging.getLogger("hms.worker")
+
+_running = True
+
+
+def _stop(signum, frame):
+    global _running
+    logger.info("Received signal %s, finishing current job and exiting", signum)
+    _running = False
+
+
+def run_job(db, db_job: models.Job):
+    handler = JOB_HANDLERS.get(db_job.job_type)
+    if handler is None:
+        crud.fail_job(db, db_job, f"Unknown job type '{db_job.job_type}'")
+        return
+
+    document = db_job.document
+    if document is None:
+        crud.complete_job(db, db_job, {})
+        return
+    # Never hand an infected or not yet scanned file to the image/PDF parsers
+    if db_job.job_type != 'virus_scan' and document.scan_result not in crud.SAFE_SCAN_RESULTS:
+        if document.scan_result == 'infected':
+            crud.complete_job(db, db_job, {})
+        else:
+            crud.defer_job(db, db_job, timedelta(seconds=settings.JOB_POLL_INTERVAL_SECONDS))
+        return
+
+    try:
+        document_updates = handler(document.storage_path)
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed", db_job.job_id, db_job.job_type)
+        db.rollback()
+        crud.fail_job(db, db_job, str(exc))
+        return
+
+    try:
+        crud.complete_job(db, db_job, document_updates)
+    except Exception as exc:
+        # e.g. the database rejecting the extracted text; retry instead of crashing the worker
+        logger.exception("Job %s (%s) failed to store its result", db_job.job_id, db_job.job_type)
+        db.rollback()
+        crud.fail_job(db, db_job, str(exc))
+        return
+    logger.info("Job %s (%s) done for document %s", db_job.job_id, db_job.job_type, document.document_id)
+
+
+def run_worker(facility: str = DEFAULT_FACILITY):
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    models.Base.metadata.create_all(bind=facility_engines[facility])
+    SessionLocal = facility_sessions[facility]
+
+    logger.info("Worker started for facility %s", facility)
+    last_sweep = None
+    while _running:
+        # Recover jobs of crashed workers periodically, not only when a worker starts
+        if last_sweep is None or time.monotonic() - last_sweep >= settings.JOB_LEASE_SWEEP_INTERVAL_SECONDS:
+            with SessionLocal() as db:
+                recovered = crud.requeue_stale_jobs(db, timedelta(seconds=settings.JOB_LEASE_SECONDS))
+            if recovered:
+                logger.info("Recovered %s stale jobs", recovered)
+            last_sweep = time.monotonic()
+
+        with SessionLocal() as db:
+            db_job = crud.claim_next_job(db)
+            if db_job is not None:
+                run_job(db, db_job)
+        if db_job is None:
+            time.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Process uploaded documents.")
+    parser.add_argument("--facility", choices=list(facility_sessions), default=DEFAULT_FACILITY, help="Facility whose jobs to process")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run_worker(args.facility)
@@ -13,6 +13,7 @@ const PatientRegistration = () => {
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [success, setSuccess] = useState<string | null>(null);
+  const [hasDuplicates, setHasDuplicates] = useState(false);
 
   const resetForm = () => {
     setFullName('');
@@ -23,11 +24,11 @@ const PatientRegistration = () => {
     setPresentingComplaint('');
   };
 
-  const handleSubmit = async (e: FormEvent) => {
-    e.preventDefault();
+  const submitPatient = async (allowDuplicate: boolean) => {
     setIsLoading(true);
     setError(null);
     setSuccess(null);
+    setHasDuplicates(false);
 
     const patientData = {
       full_name: fullName,
@@ -39,11 +40,20 @@ const PatientRegistration = () => {
     };
 
     try {
-      await apiClient.post('/patients/', patientData);
+      await apiClient.post('/patients/', patientData, {
+        params: allowDuplicate ? { allow_duplicate: true } : undefined,
+      });
       setSuccess('Patient registered successfully!');
       resetForm();
     } catch (err: any) {
-      if (err.response && err.response.data && err.response.data.detail) {
+      if (err.response && err.response.status === 409 && err.response.data.detail.matches) {
+        // Probable duplicate: name the existing records so staff can check them first
+        const matches = err.response.data.detail.matches
+          .map((m: any) => `${m.patient.full_name} (ID ${m.patient.patient_id})`)
+          .join(', ');
+        setError(`${err.response.data.detail.message}: ${matches}`);
+        setHasDuplicates(true);
+      } else if (err.response && err.response.data && err.response.data.detail) {
         setError(Array.isArray(err.response.data.detail) ? err.response.data.detail[0].msg : err.response.data.detail);
       } else {
         setError('An unexpected error occurred. Please try again.');
@@ -54,6 +64,11 @@ const PatientRegistration = () => {
     }
   };
 
+  const handleSubmit = (e: FormEvent) => {
+    e.preventDefault();
+    submitPatient(false);
+  };
+
   return (
     <div className="max-w-2xl mx-auto bg-white p-8 rounded-xl shadow-md">
       <div className="mb-6">
@@ -151,6 +166,19 @@ const PatientRegistration = () => {
             {error}
           </div>
         )}
+        {hasDuplicates && (
+          // A distinct person can still match (e.g. twins), so staff may confirm and register anyway
+          <div className="flex justify-end">
+            <button
+              type="button"
+              disabled={isLoading}
+              onClick={() => submitPatient(true)}
+              className="px-4 py-2 text-sm font-medium text-red-700 border border-red-300 rounded-lg hover:bg-red-50 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-red-500 disabled:opacity-50"
+            >
+              Not the same person, register anyway
+            </button>
+          </div>
+        )}
 
         <div className="flex justify-end">
           <button